@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+
+from api.downloader import Downloader
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    # spaces out requests evenly, shared by every coroutine of a run so all monthly chunks stay under one limit
+    def __init__(self, requests_per_second=None):
+        self._interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_slot = 0.0
+        self._lock = None
+
+    async def acquire(self):
+        if self._interval == 0.0:
+            return
+        # created lazily, on python 3.8 a lock is bound to the event loop that is current when it is created
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class AsyncDownloader:
+    DEFAULT_CONFIG = {**Downloader.DEFAULT_CONFIG, 'rate_limit': None}
+
+    def __init__(self, config=None, headers=None, rate_limiter=None):
+        config = {**AsyncDownloader.DEFAULT_CONFIG, **(config or {})}
+        self._workers = config['workers']
+        self._retries = config['retries']
+        self._backoff_factor = config['backoff_factor']
+        self._timeout = aiohttp.ClientTimeout(total=None, sock_connect=config['timeout'], sock_read=config['timeout'])
+        self._chunk_size = config['chunk_size']
+        self._headers = headers or {}
+        self._rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(config['rate_limit'])
+        self._session = None
+
+    @property
+    def rate_limiter(self):
+        return self._rate_limiter
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            # the connector limit bounds the number of concurrent transfers across every chunk
+            connector = aiohttp.TCPConnector(limit=self._workers)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self._headers, timeout=self._timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def download(self, url, dest, expected_size=None):
+        if Downloader.is_complete(dest, expected_size):
+            metrics.increment('downloads_skipped')
+            return dest
+        start = time.perf_counter()
+        for attempt in range(self._retries + 1):
+            try:
+                await self._download(url, dest, expected_size)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self._retries or (isinstance(e, aiohttp.ClientResponseError) and e.status not in Downloader.RETRY_STATUSES):
+                    raise
+                delay = AsyncDownloader._get_retry_after(e) or self._backoff_factor * (2 ** attempt)
+                logger.warning(f'Download failed ({e}), retrying in {delay:.1f}s (Url: {url})')
+                await asyncio.sleep(delay)
+        metrics.add_time('download', time.perf_counter() - start)
+        metrics.increment('granules_downloaded')
+        return dest
+
+    @staticmethod
+    def _get_retry_after(error):
+        headers = getattr(error, 'headers', None) or {}
+        retry_after = headers.get('Retry-After')
+        return float(retry_after) if retry_after is not None and retry_after.isdigit() else None
+
+    async def _download(self, url, dest, expected_size):
+        part = dest + Downloader.PART_SUFFIX
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        if expected_size is not None and offset > expected_size:
+            os.remove(part)
+            offset = 0
+        if expected_size is None or offset < expected_size:
+            await self._stream_to_file(url, part, offset)
+        if expected_size is not None and os.path.getsize(part) != expected_size:
+            os.remove(part)
+            raise IOError(f'Downloaded file size does not match expected size {expected_size} (Url: {url})')
+        os.replace(part, dest)
+
+    async def _stream_to_file(self, url, part, offset):
+        await self._rate_limiter.acquire()
+        headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+        loop = asyncio.get_running_loop()
+        async with self._session.get(url, headers=headers) as response:
+            if response.status == 416 and offset > 0:
+                os.remove(part)
+                return await self._stream_to_file(url, part, 0)
+            response.raise_for_status()
+            mode = 'ab' if response.status == 206 else 'wb'
+            # a cancelled transfer leaves the .part file behind, so the next run resumes it
+            with open(part, mode) as f:
+                async for chunk in response.content.iter_chunked(self._chunk_size):
+                    await loop.run_in_executor(None, f.write, chunk)
+                    metrics.increment('bytes_downloaded', len(chunk))
+
+    async def download_all(self, destination_by_url, expected_sizes=None):
+        expected_sizes = expected_sizes or {}
+        await self.open()
+        return await asyncio.gather(*[
+            self.download(url, dest, expected_sizes.get(dest)) for url, dest in destination_by_url.items()
+        ])
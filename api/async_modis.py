@@ -0,0 +1,131 @@
+from api import API
+from api.async_downloader import AsyncDownloader
+from api.modis import Modis
+
+from pathlib import Path
+import asyncio
+import functools
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class AsyncModis(Modis):
+    # the search client and the catalog are synchronous, their calls run in the default executor to keep the event loop free
+
+    def __init__(self, config_name="ModisAPI", search_client=None, catalog=None):
+        super().__init__(config_name, search_client, catalog)
+        self._async_downloader = AsyncDownloader(self._config.get('download'), headers={
+            'Authorization': f'Bearer {self._api_key}'
+        })
+        # one limiter for searches and downloads of every chunk
+        self._rate_limiter = self._async_downloader.rate_limiter
+
+    async def __aenter__(self):
+        await self._async_downloader.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await self._async_downloader.close()
+
+    async def download(self,
+                    download_path,
+                    box=None,
+                    date_from=None,
+                    date_to=None,
+                    product_type=None):
+        box = API.get_default_if_empty(box, self._get_default_box())
+        date_from = API.get_default_if_empty(date_from, self._defaults['time']['start'])
+        date_to = API.get_default_if_empty(date_to, self._defaults['time']['end'])
+        product_name = API.get_default_if_empty(product_type, self._defaults['product_type'])
+        dates_by_month = API.split_by_month(date_from, date_to)
+        await AsyncModis._gather_chunks([
+            self._download_files_async(download_path, box, date[0], date[1], product_name) for date in dates_by_month
+        ])
+        return Modis._get_bounds(box)
+
+    async def download_and_process(self,
+                            download_path,
+                            process_func,
+                            box=None,
+                            date_from=None,
+                            date_to=None,
+                            product_type=None,
+                            watermarks=None,
+                            region_name=None,
+                            router=None,
+                            output_name=None):
+        box = API.get_default_if_empty(box, self._get_default_box())
+        date_from = API.get_default_if_empty(date_from, self._defaults['time']['start'])
+        date_to = API.get_default_if_empty(date_to, self._defaults['time']['end'])
+        product_name = API.get_default_if_empty(product_type, self._defaults['product_type'])
+        watermark = None if watermarks is None else watermarks.get(product_name, region_name)
+        date_from = Modis._get_incremental_start(date_from, watermark)
+        if date_from > date_to:
+            logger.info(f'Nothing to process, {product_name} is up to date until {watermark}')
+            return
+        dates_by_month = API.split_by_month(date_from, date_to)
+        output_key = self._get_output_key(product_name, API.get_default_if_empty(output_name, region_name), box)
+        logger.info(f'Processing from {date_from} to {date_to}')
+        north, south, east, west = Modis._get_bounds(box)
+        on_processed = functools.partial(
+            self._set_processed, product_type=product_name, watermarks=watermarks, region_name=region_name, output_key=output_key
+        )
+        loop = asyncio.get_running_loop()
+        # every chunk downloads into its own directory, so processing one month never picks up granules of another
+        chunk_paths = [os.path.join(download_path, date[0][:7]) for date in dates_by_month]
+        downloads = [
+            asyncio.ensure_future(self._download_files_async(chunk_path, box, date[0], date[1], product_name, watermark, router, output_key))
+            for chunk_path, date in zip(chunk_paths, dates_by_month)
+        ]
+        try:
+            # chunks download concurrently but are processed in order, so the watermark only moves forward
+            for i, (chunk_path, date, download) in enumerate(zip(chunk_paths, dates_by_month, downloads), 1):
+                await download
+                logger.info(f'Start processing from {date[0]} to {date[1]}. Chunk: {i}/{len(dates_by_month)}')
+                Path(chunk_path).mkdir(parents=True, exist_ok=True)
+                await loop.run_in_executor(None, functools.partial(process_func, on_processed=on_processed), chunk_path, (south, north), (west, east))
+        finally:
+            # on cancellation or failure the remaining chunks stop, partial downloads are resumed by the next run
+            await AsyncModis._cancel(downloads)
+
+    async def _download_files_async(self, download_path, box, date_from, date_to, product_type, newer_than=None, router=None, output_key=None):
+        loop = asyncio.get_running_loop()
+        await self._rate_limiter.acquire()
+        filename_by_url, expected_sizes = await loop.run_in_executor(
+            None, self._search_files, download_path, box, date_from, date_to, product_type, newer_than, router, output_key
+        )
+        await self._async_downloader.open()
+        downloads = [
+            asyncio.ensure_future(self._async_downloader.download(url, dest, expected_sizes.get(dest)))
+            for url, dest in filename_by_url.items()
+        ]
+        downloaded = []
+        try:
+            for i, future in enumerate(asyncio.as_completed(downloads), 1):
+                dest = await future
+                await loop.run_in_executor(None, self._set_status, dest, True)
+                downloaded.append(dest)
+                logger.info(f'Downloaded: {i}/{len(filename_by_url)} (Path: {dest})')
+        finally:
+            await AsyncModis._cancel(downloads)
+        return downloaded
+
+    @staticmethod
+    async def _gather_chunks(coroutines):
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            await AsyncModis._cancel(tasks)
+
+    @staticmethod
+    async def _cancel(tasks):
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if len(pending) > 0:
+            await asyncio.gather(*pending, return_exceptions=True)
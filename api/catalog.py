@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+import json
+import sqlite3
+import threading
+
+class GranuleCatalog:
+    PENDING = 'pending'
+    DONE = 'done'
+    DEFAULT_SETTLE_DAYS = 7
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS searches (
+            search_key TEXT PRIMARY KEY,
+            product TEXT NOT NULL,
+            collection INTEGER NOT NULL,
+            date_from TEXT NOT NULL,
+            date_to TEXT NOT NULL,
+            box TEXT NOT NULL,
+            searched_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS granules (
+            file_name TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            product TEXT NOT NULL,
+            url TEXT NOT NULL,
+            size INTEGER,
+            download_status TEXT NOT NULL DEFAULT 'pending'
+        );
+        CREATE TABLE IF NOT EXISTS search_granules (
+            search_key TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            PRIMARY KEY (search_key, file_name)
+        );
+        CREATE TABLE IF NOT EXISTS extractions (
+            output_key TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            extracted_at TEXT NOT NULL,
+            PRIMARY KEY (output_key, file_name)
+        );
+    """
+
+    def __init__(self, path, settle_days=DEFAULT_SETTLE_DAYS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._settle_days = settle_days
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.executescript(GranuleCatalog.SCHEMA)
+
+    @staticmethod
+    def get_search_key(product, collection, date_from, date_to, box):
+        return json.dumps([product, collection, date_from, date_to, [round(float(coord), 6) for coord in box]])
+
+    @staticmethod
+    def get_output_key(product, output_name, box):
+        # a granule is extracted once per output, regions sharing a granule each still extract it
+        return json.dumps([product, output_name, [round(float(coord), 6) for coord in box]])
+
+    def get_search(self, product, collection, date_from, date_to, box):
+        search_key = GranuleCatalog.get_search_key(product, collection, date_from, date_to, box)
+        with self._lock:
+            search = self._connection.execute(
+                'SELECT date_to, searched_at FROM searches WHERE search_key = ?', (search_key,)
+            ).fetchone()
+            if search is None or not self._is_settled(search['date_to'], search['searched_at']):
+                return None
+            return [dict(row) for row in self._connection.execute(
+                'SELECT g.* FROM granules g JOIN search_granules s ON g.file_name = s.file_name '
+                'WHERE s.search_key = ? ORDER BY g.file_name', (search_key,)
+            )]
+
+    def _is_settled(self, date_to, searched_at):
+        # archives keep changing for recent days, so only searches done well after date_to are reused
+        return datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=self._settle_days) <= datetime.fromisoformat(searched_at)
+
+    def save_search(self, product, collection, date_from, date_to, box, granules):
+        search_key = GranuleCatalog.get_search_key(product, collection, date_from, date_to, box)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (search_key, product, collection, date_from, date_to, json.dumps(list(box)), datetime.now().isoformat())
+            )
+            self._connection.execute('DELETE FROM search_granules WHERE search_key = ?', (search_key,))
+            for granule in granules:
+                self._connection.execute(
+                    'INSERT INTO granules (file_name, file_id, product, url, size) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (file_name) DO UPDATE SET file_id = excluded.file_id, url = excluded.url, size = excluded.size',
+                    (granule['file_name'], granule['file_id'], product, granule['url'], granule['size'])
+                )
+                self._connection.execute(
+                    'INSERT OR IGNORE INTO search_granules VALUES (?, ?)', (search_key, granule['file_name'])
+                )
+        return self.get_granules([granule['file_name'] for granule in granules])
+
+    def get_granules(self, file_names):
+        with self._lock:
+            rows = [self._connection.execute('SELECT * FROM granules WHERE file_name = ?', (file_name,)).fetchone() for file_name in file_names]
+        return [dict(row) for row in rows if row is not None]
+
+    def set_download_status(self, file_name, status):
+        self._set_status('download_status', file_name, status)
+
+    def set_extracted(self, output_key, file_name):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR IGNORE INTO extractions VALUES (?, ?, ?)', (output_key, file_name, datetime.now().isoformat())
+            )
+
+    def get_extracted(self, output_key, file_names):
+        with self._lock:
+            extracted = set([row['file_name'] for row in self._connection.execute(
+                'SELECT file_name FROM extractions WHERE output_key = ?', (output_key,)
+            )])
+        return [file_name for file_name in file_names if file_name in extracted]
+
+    def _set_status(self, column, file_name, status):
+        with self._lock, self._connection:
+            self._connection.execute(f'UPDATE granules SET {column} = ? WHERE file_name = ?', (status, file_name))
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import os
+
+from core.granules import CHECKSUM_SUFFIX
+from core.metrics import metrics
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class Downloader:
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    DEFAULT_CONFIG = {
+        'workers': 4,
+        'retries': 5,
+        'backoff_factor': 1.0,
+        'timeout': 60,
+        'chunk_size': 1024 * 1024
+    }
+    PART_SUFFIX = '.part'
+    CHECKSUM_SUFFIX = CHECKSUM_SUFFIX
+
+    def __init__(self, config=None, headers=None, auth=None):
+        config = {**Downloader.DEFAULT_CONFIG, **(config or {})}
+        self._workers = config['workers']
+        self._timeout = config['timeout']
+        self._chunk_size = config['chunk_size']
+        self._session = Downloader._create_session(config, headers, auth)
+
+    @staticmethod
+    def _create_session(config, headers, auth=None):
+        retry = Retry(
+            total=config['retries'],
+            backoff_factor=config['backoff_factor'],
+            status_forcelist=Downloader.RETRY_STATUSES,
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['workers'], max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(headers or {})
+        session.auth = auth
+        return session
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @staticmethod
+    def is_complete(dest, expected_size=None, expected_md5=None):
+        if not os.path.isfile(dest):
+            return False
+        if expected_size is not None and os.path.getsize(dest) != expected_size:
+            return False
+        return expected_md5 is None or Downloader._read_checksum(dest) == expected_md5.lower()
+
+    @staticmethod
+    def _read_checksum(dest):
+        checksum_file = dest + Downloader.CHECKSUM_SUFFIX
+        if not os.path.isfile(checksum_file):
+            return None
+        with open(checksum_file) as f:
+            return f.read().strip()
+
+    @staticmethod
+    def _write_checksum(dest, checksum):
+        with open(dest + Downloader.CHECKSUM_SUFFIX, 'w') as f:
+            f.write(checksum)
+
+    def download(self, url, dest, expected_size=None, expected_md5=None):
+        if Downloader.is_complete(dest, expected_size, expected_md5):
+            metrics.increment('downloads_skipped')
+            return dest
+        with metrics.timer('download'):
+            self._download(url, dest, expected_size, expected_md5)
+        metrics.increment('granules_downloaded')
+        return dest
+
+    def _download(self, url, dest, expected_size, expected_md5):
+        part = dest + Downloader.PART_SUFFIX
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        if expected_size is not None and offset > expected_size:
+            os.remove(part)
+            offset = 0
+        md5 = Downloader._hash_part(part, offset, self._chunk_size) if expected_md5 is not None else None
+        if expected_size is None or offset < expected_size:
+            md5 = self._stream_to_file(url, part, offset, md5)
+        if expected_size is not None and os.path.getsize(part) != expected_size:
+            os.remove(part)
+            raise IOError(f'Downloaded file size does not match expected size {expected_size} (Url: {url})')
+        if md5 is not None:
+            if md5.hexdigest() != expected_md5.lower():
+                os.remove(part)
+                raise IOError(f'Downloaded file checksum does not match expected MD5 {expected_md5} (Url: {url})')
+            Downloader._write_checksum(dest, md5.hexdigest())
+        os.replace(part, dest)
+
+    @staticmethod
+    def _hash_part(part, offset, chunk_size):
+        # only an interrupted download is read back from disk, everything else is hashed while it is streamed
+        md5 = hashlib.md5()
+        if offset > 0:
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    md5.update(chunk)
+        return md5
+
+    def _stream_to_file(self, url, part, offset, md5=None):
+        headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+        with self._session.get(url, headers=headers, stream=True, timeout=self._timeout) as response:
+            if response.status_code == 416 and offset > 0:
+                os.remove(part)
+                return self._stream_to_file(url, part, 0, hashlib.md5() if md5 is not None else None)
+            response.raise_for_status()
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            if mode == 'wb' and md5 is not None:
+                md5 = hashlib.md5()
+            with open(part, mode) as f:
+                for chunk in response.iter_content(chunk_size=self._chunk_size):
+                    f.write(chunk)
+                    metrics.increment('bytes_downloaded', len(chunk))
+                    if md5 is not None:
+                        md5.update(chunk)
+        return md5
+
+    def download_all(self, destination_by_url, expected_sizes=None, expected_md5s=None, cancelled=None):
+        expected_sizes = expected_sizes or {}
+        expected_md5s = expected_md5s or {}
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = [
+                executor.submit(self.download, url, dest, expected_sizes.get(dest), expected_md5s.get(dest)) 
+                for url, dest in destination_by_url.items()
+            ]
+            for future in as_completed(futures):
+                if cancelled is not None and cancelled.is_set():
+                    # running downloads are finished, the queued ones are dropped
+                    for pending in futures:
+                        pending.cancel()
+                    raise RuntimeError('Downloads cancelled')
+                yield future.result()
+
+    def close(self):
+        self._session.close()
@@ -1,29 +1,55 @@
 from api import API
 from api.config import load_config, get_api_key
+from api.downloader import Downloader
+from api.catalog import GranuleCatalog
+from api.tiles import load_tile_index, TileRouter
+from core.granules import get_acquisition_time, remove_granule, sort_by_acquisition_time
+from core.metrics import metrics
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-import numpy as np
+import functools
+import logging
+import os
+import queue
+import threading
 import urllib.request as urllib
-import requests
 import urllib.parse as urlparse
 from pymodis import downmodis
 import modapsclient as m
 
+logger = logging.getLogger(__name__)
+
 class Modis(API):
     CONFIG_PATH = "./config/config.json"
     TILES_FILE = "./config/modis_tiles.csv"
+    DEFAULT_QUEUE_SIZE = 16
+    DEFAULT_SEARCH_BY = 'coords'
+    COLLECTION = 61
+    _END_OF_STREAM = object()
 
-    def __init__(self, config_name="ModisAPI"):
+    def __init__(self, config_name="ModisAPI", search_client=None, catalog=None):
         self._config = load_config(Modis.CONFIG_PATH, config_name)
         self._defaults = self._config['defaults']
-        self._modis_tiles = self._load_modis_tiles()
+        self._modis_tiles = load_tile_index(Modis.TILES_FILE)
+        # 'tiles' searches every MODIS tile covering the box separately, so tile searches are cached and shared across boxes
+        self._search_by = self._config.get('search_by', Modis.DEFAULT_SEARCH_BY)
         self._api_key = get_api_key(self._config)
-        self._m = m.ModapsClient()
+        self._m = m.ModapsClient() if search_client is None else search_client
+        self._catalog = catalog if catalog is not None else self._create_catalog()
+        self._downloader = Downloader(self._config.get('download'), headers={
+            'Authorization': f'Bearer {self._api_key}'
+        })
     
-    def _load_modis_tiles(self):
-        with open(Modis.TILES_FILE) as tiles_file:
-            return np.genfromtxt(tiles_file, delimiter=";")
-        return np.array([])
+    def _create_catalog(self):
+        if 'catalog' not in self._config:
+            return None
+        catalog_config = self._config['catalog']
+        return GranuleCatalog(catalog_config['path'], catalog_config.get('settle_days', GranuleCatalog.DEFAULT_SETTLE_DAYS))
+
+    def create_router(self, region_index):
+        return TileRouter(self._modis_tiles, region_index)
 
     def download_and_process(self, 
                             download_path,
@@ -31,19 +57,128 @@ class Modis(API):
                             box=None, 
                             date_from=None, 
                             date_to=None, 
-                            product_type=None):
+                            product_type=None,
+                            watermarks=None,
+                            region_name=None,
+                            router=None,
+                            output_name=None,
+                            cancelled=None):
         box = API.get_default_if_empty(box, self._get_default_box())
         date_from = API.get_default_if_empty(date_from, self._defaults['time']['start'])
         date_to = API.get_default_if_empty(date_to, self._defaults['time']['end'])
         product_name = API.get_default_if_empty(product_type, self._defaults['product_type'])
+        watermark = None if watermarks is None else watermarks.get(product_name, region_name)
+        date_from = Modis._get_incremental_start(date_from, watermark)
+        if date_from > date_to:
+            logger.info(f'Nothing to process, {product_name} is up to date until {watermark}')
+            return
         dates_by_month = API.split_by_month(date_from, date_to)
-        print(date_from, date_to)
+        output_key = self._get_output_key(product_name, API.get_default_if_empty(output_name, region_name), box)
+        on_processed = functools.partial(
+            self._set_processed, product_type=product_name, watermarks=watermarks, region_name=region_name, output_key=output_key
+        )
+        logger.info(f'Processing from {date_from} to {date_to}')
         for i, date in enumerate(dates_by_month, 1):
-            print(f'Start processing from {date[0]} to {date[1]}. Chunk: {i}/{len(dates_by_month)}')
+            logger.info(f'Start processing from {date[0]} to {date[1]}. Chunk: {i}/{len(dates_by_month)}')
             # start, end = API.get_begin_and_end_of_day(date[0], date[1])
             start, end = date[0], date[1]
-            north, south, east, west = self._download_internal(download_path, box=box, date_from=start, date_to=end, product_type=product_name)
-            process_func(download_path, (south, north), (west, east))
+            self._download_files(download_path, box=box, date_from=start, date_to=end, product_type=product_name, newer_than=watermark, router=router, output_key=output_key, cancelled=cancelled)
+            if cancelled is not None and cancelled.is_set():
+                raise RuntimeError(f'Cancelled before processing from {date[0]} to {date[1]}')
+            north, south, east, west = Modis._get_bounds(box)
+            # process_func reports every granule, skipped ones included, once the sink has committed its rows
+            process_func(download_path, (south, north), (west, east), on_processed=on_processed)
+
+    def _set_processed(self, dest, product_type, watermarks, region_name, output_key):
+        # called once the rows of a granule are committed, in acquisition order, so every granule also moves the watermark
+        self._set_status(dest, output_key=output_key)
+        if watermarks is not None:
+            watermarks.update(product_type, region_name, get_acquisition_time(dest))
+
+    def _get_output_key(self, product_type, output_name, box):
+        # output_name tells apart outputs of the same region, e.g. the shards of every scheduler attempt
+        if self._catalog is None:
+            return None
+        return GranuleCatalog.get_output_key(product_type, output_name, Modis._get_bounds(box))
+
+    @staticmethod
+    def _get_incremental_start(date_from, watermark):
+        if watermark is None:
+            return date_from
+        # the watermark day is searched again, granules up to the watermark are filtered out by acquisition time
+        return max(date_from, watermark.strftime('%Y-%m-%d'))
+
+    def download_and_process_pipelined(self, 
+                                        download_path,
+                                        process_file_func,
+                                        box=None, 
+                                        date_from=None, 
+                                        date_to=None, 
+                                        product_type=None,
+                                        delete_after=True,
+                                        watermarks=None,
+                                        region_name=None,
+                                        router=None,
+                                        output_name=None):
+        box = API.get_default_if_empty(box, self._get_default_box())
+        date_from = API.get_default_if_empty(date_from, self._defaults['time']['start'])
+        date_to = API.get_default_if_empty(date_to, self._defaults['time']['end'])
+        product_name = API.get_default_if_empty(product_type, self._defaults['product_type'])
+        watermark = None if watermarks is None else watermarks.get(product_name, region_name)
+        date_from = Modis._get_incremental_start(date_from, watermark)
+        if date_from > date_to:
+            logger.info(f'Nothing to process, {product_name} is up to date until {watermark}')
+            return
+        dates_by_month = API.split_by_month(date_from, date_to)
+        output_key = self._get_output_key(product_name, API.get_default_if_empty(output_name, region_name), box)
+        queue_size = self._config.get('download', {}).get('queue_size', Modis.DEFAULT_QUEUE_SIZE)
+        # slots bound the number of granules that are downloading or waiting on disk
+        slots = threading.BoundedSemaphore(queue_size)
+        granules = queue.Queue(maxsize=queue_size)
+        producer = threading.Thread(
+            target=self._produce_granules, 
+            args=(granules, slots, download_path, box, dates_by_month, product_name, watermark, router, output_key),
+            daemon=True
+        )
+        producer.start()
+        north, south, east, west = Modis._get_bounds(box)
+        on_processed = functools.partial(
+            self._set_processed, product_type=product_name, watermarks=watermarks, region_name=region_name, output_key=output_key
+        )
+        processed = 0
+        while True:
+            item = granules.get()
+            if item is Modis._END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            # downloads run concurrently but are handed over in acquisition order, so progress is recorded per granule
+            dest = item.result()
+            self._set_status(dest, downloaded=True)
+            try:
+                process_file_func(dest, (south, north), (west, east), on_processed=on_processed)
+                processed += 1
+                logger.info(f'Processed granule... {processed} (Path: {dest})')
+            finally:
+                if delete_after and os.path.isfile(dest):
+                    remove_granule(dest)
+                slots.release()
+        producer.join()
+
+    def _produce_granules(self, granules, slots, download_path, box, dates_by_month, product_type, newer_than=None, router=None, output_key=None):
+        try:
+            with ThreadPoolExecutor(max_workers=self._downloader.workers) as executor:
+                for i, date in enumerate(dates_by_month, 1):
+                    logger.info(f'Start downloading from {date[0]} to {date[1]}. Chunk: {i}/{len(dates_by_month)}')
+                    filename_by_url, expected_sizes = self._search_files(download_path, box, date[0], date[1], product_type, newer_than, router, output_key)
+                    url_by_filename = dict([(dest, url) for url, dest in filename_by_url.items()])
+                    for dest in sort_by_acquisition_time(url_by_filename.keys()):
+                        slots.acquire()
+                        granules.put(executor.submit(self._downloader.download, url_by_filename[dest], dest, expected_sizes.get(dest)))
+        except Exception as e:
+            granules.put(e)
+        finally:
+            granules.put(Modis._END_OF_STREAM)
 
     def download(self, 
                     download_path,
@@ -64,39 +199,143 @@ class Modis(API):
                             date_from, 
                             date_to, 
                             product_type):
+        self._download_files(download_path, box, date_from, date_to, product_type)
+        return Modis._get_bounds(box)
+
+    def _download_files(self, download_path, box, date_from, date_to, product_type, newer_than=None, router=None, output_key=None, cancelled=None):
+        filename_by_url, expected_sizes = self._search_files(download_path, box, date_from, date_to, product_type, newer_than, router, output_key)
+        downloaded = []
+        for i, dest in enumerate(self._downloader.download_all(filename_by_url, expected_sizes, cancelled=cancelled), 1):
+            self._set_status(dest, downloaded=True)
+            downloaded.append(dest)
+            logger.info(f'Downloaded: {i}/{len(filename_by_url)} (Path: {dest})')
+        return downloaded
+
+    def _search_files(self, download_path, box, date_from, date_to, product_type, newer_than=None, router=None, output_key=None):
+        if router is not None:
+            granules = self._find_granules_by_tiles(router.tiles, date_from, date_to, product_type, router)
+        else:
+            granules = self._find_granules(box, date_from, date_to, product_type)
+        if newer_than is not None:
+            granules = [granule for granule in granules if (get_acquisition_time(granule['file_name']) or datetime.max) > newer_than]
+            logger.info(f'Found: {len(granules)} files newer than {newer_than}')
+        if output_key is not None:
+            # extraction is tracked per output, another region or box over the same granules still extracts them
+            extracted = set(self._catalog.get_extracted(output_key, [granule['file_name'] for granule in granules]))
+            logger.info(f'Skipping {len(extracted)} files already extracted into this output')
+            granules = [granule for granule in granules if granule['file_name'] not in extracted]
+        if len(granules) > 0:
+            Path(download_path).mkdir(parents=True, exist_ok=True)
+        filename_by_url = dict([(granule['url'], self._get_full_path(download_path, granule['url'])) for granule in granules])
+        expected_sizes = dict([(self._get_full_path(download_path, granule['url']), granule['size']) for granule in granules])
+        return filename_by_url, expected_sizes
+
+    def _find_granules(self, box, date_from, date_to, product_type):
+        north, south, east, west = Modis._get_bounds(box)
+        logger.debug(f"N: {north}, S: {south}, W: {west}, E: {east}")
+        if self._search_by == 'tiles':
+            return self._find_granules_by_tiles(self._modis_tiles.get_tiles((south, north), (west, east)), date_from, date_to, product_type)
+        if self._catalog is not None:
+            granules = self._catalog.get_search(product_type, Modis.COLLECTION, date_from, date_to, (north, south, east, west))
+            if granules is not None:
+                logger.info(f'Found: {len(granules)} files in catalog')
+                return granules
+        with metrics.timer('search'):
+            file_ids = self._m.searchForFiles(
+                    products=product_type,
+                    startTime=date_from,
+                    endTime=date_to,
+                    north=north,
+                    south=south,
+                    west=west,
+                    east=east,
+                    coordsOrTiles='coords',
+                    collection=Modis.COLLECTION
+            )
+        logger.info(f'Found: {len(file_ids)} files')
+        with metrics.timer('resolve_urls'):
+            granules = self._get_granules(file_ids)
+        if self._catalog is None:
+            return granules
+        return self._catalog.save_search(product_type, Modis.COLLECTION, date_from, date_to, (north, south, east, west), granules)
+
+    def _find_granules_by_tiles(self, tiles, date_from, date_to, product_type, router=None):
+        granules_by_tile = {}
+        file_ids_by_tile = {}
+        for tile in tiles:
+            granules = None
+            if self._catalog is not None:
+                granules = self._catalog.get_search(product_type, Modis.COLLECTION, date_from, date_to, tile)
+            if granules is not None:
+                granules_by_tile[tile] = granules
+                continue
+            iv, ih = tile
+            with metrics.timer('search'):
+                file_ids_by_tile[tile] = self._m.searchForFiles(
+                        products=product_type,
+                        startTime=date_from,
+                        endTime=date_to,
+                        north=iv,
+                        south=iv,
+                        west=ih,
+                        east=ih,
+                        coordsOrTiles='tiles',
+                        collection=Modis.COLLECTION
+                )
+        # neighbouring tiles return many of the same granules, their urls are resolved once
+        file_ids = sorted(set([file_id for file_ids in file_ids_by_tile.values() for file_id in file_ids]))
+        with metrics.timer('resolve_urls'):
+            granule_by_id = dict([(granule['file_id'], granule) for granule in self._get_granules(file_ids)])
+        for tile, tile_file_ids in file_ids_by_tile.items():
+            granules = [granule_by_id[str(file_id)] for file_id in tile_file_ids if str(file_id) in granule_by_id]
+            if self._catalog is not None:
+                granules = self._catalog.save_search(product_type, Modis.COLLECTION, date_from, date_to, tile, granules)
+            granules_by_tile[tile] = granules
+        granule_by_name = {}
+        for tile in tiles:
+            if router is not None:
+                router.add(tile, granules_by_tile[tile])
+            for granule in granules_by_tile[tile]:
+                granule_by_name.setdefault(granule['file_name'], granule)
+        logger.info(f'Found: {len(granule_by_name)} files in {len(tiles)} tiles')
+        return [granule_by_name[name] for name in sorted(granule_by_name)]
+
+    def _get_granules(self, file_ids):
+        if len(file_ids) == 0:
+            return []
+        file_urls = self._m.getFileUrls(",".join(file_ids))
+        url_by_name = dict([(self._get_file_name(url), url) for url in file_urls])
+        properties = self._m.getFileProperties(",".join(file_ids))
+        return [{
+            'file_id': str(p['fileId']),
+            'file_name': p['fileName'],
+            'url': url_by_name[p['fileName']],
+            'size': int(p['fileSizeBytes'])
+        } for p in properties if p['fileName'] in url_by_name]
+
+    def _set_status(self, dest, downloaded=False, output_key=None):
+        if self._catalog is None:
+            return
+        file_name = os.path.basename(dest)
+        if downloaded:
+            self._catalog.set_download_status(file_name, GranuleCatalog.DONE)
+        if output_key is not None:
+            self._catalog.set_extracted(output_key, file_name)
+
+    @staticmethod
+    def _get_bounds(box):
         north = box[0] if box[0] > box[2] else box[2]
         south = box[2] if box[2] < box[0] else box[0]
         west = box[1] if box[1] < box[3] else box[3]
         east = box[3] if box[3] > box[1] else box[1]
-        print(f"N: {north}, S: {south}, W: {west}, E: {east}")
-        file_ids = self._m.searchForFiles(
-                products=product_type,
-                startTime=date_from,
-                endTime=date_to,
-                north = box[0] if box[0] > box[2] else box[2],
-                south = box[2] if box[2] < box[0] else box[0],
-                west = box[1] if box[1] < box[3] else box[3],
-                east = box[3] if box[3] > box[1] else box[1],
-                coordsOrTiles='coords',
-                collection=61
-        )
-        print(f'Found: {len(file_ids)} files')
-        if len(file_ids) > 0:
-            Path(download_path).mkdir(parents=True, exist_ok=True)
-        file_urls = self._m.getFileUrls(",".join(file_ids))
-        filename_by_url = dict([(url, self._get_full_path(download_path, url)) for url in file_urls])
-        for url, dest in filename_by_url.items():
-            response = requests.get(url, headers={
-                'Authorization': f'Bearer {self._api_key}'
-            })
-            with open(dest, 'wb') as f:
-                f.write(response.content)
         return north, south, east, west
 
-    def _get_full_path(self, download_path, url):
+    def _get_file_name(self, url):
         split = urlparse.urlsplit(url)
-        file_name = split.path.split("/")[-1]
-        return f'{download_path}/{file_name}'.replace("//", "/")
+        return split.path.split("/")[-1]
+
+    def _get_full_path(self, download_path, url):
+        return f'{download_path}/{self._get_file_name(url)}'.replace("//", "/")
 
     def get_info(self):
         return {
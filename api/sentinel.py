@@ -1,17 +1,50 @@
 from api import API
 from api.config import load_config, get_credentials
+from api.downloader import Downloader
+from core.metrics import metrics
 
+from extractors.regions import Region
+import logging
+import os
+
+from pathlib import Path
 from sentinelsat import SentinelAPI, read_geojson, geojson_to_wkt
 
+logger = logging.getLogger(__name__)
+
 class Sentinel5P(API):
     CONFIG_PATH = "./config/config.json"
+    FILE_EXTENSION = ".nc"
 
-    def __init__(self, config_name="SentinelAPI"):
+    def __init__(self, config_name="SentinelAPI", hub=None):
         self._config = load_config(Sentinel5P.CONFIG_PATH, config_name)
         self._defaults = self._config['default']
         self._api_link = self._config['api_link']
         user, password = get_credentials(self._config)
-        self._api = SentinelAPI(user, password, self._api_link)
+        # hub only has to provide query and get_product_odata, so a local fake can replace the remote one
+        self._api = SentinelAPI(user, password, self._api_link) if hub is None else hub
+        self._downloader = Downloader(self._config.get('download'), auth=(user, password))
+
+    def download_and_process(self, 
+                            download_path,
+                            process_func,
+                            area_gjson=None, 
+                            date_from=None, 
+                            date_to=None, 
+                            platform_name=None, 
+                            product_type=None):
+        area = API.get_default_if_empty(area_gjson, self._defaults['area'])
+        date_from = API.get_default_if_empty(date_from, self._defaults['time']['start'])
+        date_to = API.get_default_if_empty(date_to, self._defaults['time']['end'])
+        platform_name = API.get_default_if_empty(platform_name, self._defaults['platform_name'])
+        product_type = API.get_default_if_empty(product_type, self._defaults['product_type'])
+        latitude_range, longitude_range = Sentinel5P._get_ranges(area)
+        dates_by_month = API.split_by_month(date_from, date_to)
+        logger.info(f'Processing from {date_from} to {date_to}')
+        for i, date in enumerate(dates_by_month, 1):
+            logger.info(f'Start processing from {date[0]} to {date[1]}. Chunk: {i}/{len(dates_by_month)}')
+            self._download_internal(download_path, area, date[0], date[1], platform_name, product_type)
+            process_func(download_path, latitude_range, longitude_range)
 
     def download(self, 
                 download_path,
@@ -20,17 +53,44 @@ class Sentinel5P(API):
                 date_to=None, 
                 platform_name=None, 
                 product_type=None):
-        area = API.get_default_if_empty(area_gjson, self._defaults['area'])
-        products = self._api.query(
-            geojson_to_wkt(area) if area is not None else None,
-            date=self._parse_date(
-                API.get_default_if_empty(date_from, self._defaults['time']['start']), 
-                API.get_default_if_empty(date_to, self._defaults['time']['end'])
-            ),
-            platformname=API.get_default_if_empty(platform_name, self._defaults['platform_name']),
-            producttype=API.get_default_if_empty(product_type, self._defaults['product_type'])
+        self._download_internal(
+            download_path,
+            API.get_default_if_empty(area_gjson, self._defaults['area']),
+            API.get_default_if_empty(date_from, self._defaults['time']['start']),
+            API.get_default_if_empty(date_to, self._defaults['time']['end']),
+            API.get_default_if_empty(platform_name, self._defaults['platform_name']),
+            API.get_default_if_empty(product_type, self._defaults['product_type'])
         )
-        self._api.download_all(products, directory_path=download_path)
+
+    def _download_internal(self, download_path, area, date_from, date_to, platform_name, product_type):
+        with metrics.timer('search'):
+            products = self._api.query(
+                geojson_to_wkt(area) if area is not None else None,
+                date=self._parse_date(date_from, date_to),
+                platformname=platform_name,
+                producttype=product_type
+            )
+        logger.info(f'Found: {len(products)} products')
+        Path(download_path).mkdir(parents=True, exist_ok=True)
+        with metrics.timer('resolve_urls'):
+            filename_by_url, expected_sizes, expected_md5s = self._get_downloads(download_path, products)
+        for i, dest in enumerate(self._downloader.download_all(filename_by_url, expected_sizes, expected_md5s), 1):
+            logger.info(f'Downloaded: {i}/{len(filename_by_url)} (Path: {dest})')
+
+    def _get_downloads(self, download_path, products):
+        filename_by_url, expected_sizes, expected_md5s = {}, {}, {}
+        for product_id in products:
+            odata = self._api.get_product_odata(product_id)
+            dest = os.path.join(download_path, odata['title'] + Sentinel5P.FILE_EXTENSION)
+            filename_by_url[odata['url']] = dest
+            expected_sizes[dest] = int(odata['size'])
+            expected_md5s[dest] = odata['md5']
+        return filename_by_url, expected_sizes, expected_md5s
+
+    @staticmethod
+    def _get_ranges(area):
+        region = Region('area', area)
+        return region.latitude_range, region.longitude_range
 
     def _parse_date(self, date_from, date_to):
         return (date_from.replace('-', ''), date_to.replace('-', ''))
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import logging
+import os
+import numpy as np
+
+from extractors.regions import points_in_rings, segments_intersect_boxes
+
+logger = logging.getLogger(__name__)
+
+TILES_FILE = "./config/modis_tiles.csv"
+NO_DATA = -999.0
+_tile_indexes = {}
+
+class TileIndex:
+    # bounding boxes of the MODIS sinusoidal tiles, one row per tile as iv, ih, lon_min, lon_max, lat_min, lat_max
+
+    def __init__(self, tiles):
+        self._tiles = tiles
+
+    def __len__(self):
+        return len(self._tiles)
+
+    @property
+    def ids(self):
+        return [(int(iv), int(ih)) for iv, ih in self._tiles[:, :2]]
+
+    def intersects(self, latitude_ranges, longitude_ranges):
+        # one row per box and one column per tile, computed for all boxes at once
+        latitude_ranges = np.asarray(latitude_ranges, dtype=float).reshape(-1, 2)
+        longitude_ranges = np.asarray(longitude_ranges, dtype=float).reshape(-1, 2)
+        lon_min, lon_max, lat_min, lat_max = self._tiles[:, 2], self._tiles[:, 3], self._tiles[:, 4], self._tiles[:, 5]
+        return (
+            (longitude_ranges[:, 0, None] <= lon_max) & (longitude_ranges[:, 1, None] >= lon_min) &
+            (latitude_ranges[:, 0, None] <= lat_max) & (latitude_ranges[:, 1, None] >= lat_min)
+        )
+
+    def get_tiles(self, latitude_range, longitude_range):
+        return self._get_ids(self.intersects(latitude_range, longitude_range)[0])
+
+    def get_region_tiles(self, region_index):
+        regions = [region_index.get(name) for name in region_index.names]
+        candidates = self.intersects([region.latitude_range for region in regions], [region.longitude_range for region in regions])
+        tiles_by_region = OrderedDict()
+        for region, region_candidates in zip(regions, candidates):
+            boxes = self._tiles[region_candidates, 2:]
+            # a tile touches a polygon if an edge crosses it, or if the polygon covers the whole tile and so its center
+            edges = np.vstack([np.hstack([ring[:-1], ring[1:]]) for ring in region.rings if len(ring) > 1])
+            touched = segments_intersect_boxes(edges[:, :2], edges[:, 2:], boxes)
+            touched |= points_in_rings((boxes[:, 0] + boxes[:, 1]) / 2, (boxes[:, 2] + boxes[:, 3]) / 2, region.rings)
+            tiles_by_region[region.name] = self._get_ids(np.flatnonzero(region_candidates)[touched])
+        return tiles_by_region
+
+    def _get_ids(self, selection):
+        return [(int(iv), int(ih)) for iv, ih in self._tiles[selection, :2]]
+
+    @staticmethod
+    def from_csv(path):
+        with open(path) as tiles_file:
+            tiles = np.genfromtxt(tiles_file, delimiter=";", skip_header=1)
+        # tiles outside of the projected globe have no bounds
+        return TileIndex(tiles[tiles[:, 2] != NO_DATA])
+
+
+def load_tile_index(path=TILES_FILE):
+    # the parsed grid is cached next to the csv as .npy and kept in memory for the lifetime of the process
+    path = os.path.abspath(path)
+    if path in _tile_indexes:
+        return _tile_indexes[path]
+    cache_path = os.path.splitext(path)[0] + '.npy'
+    if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        tile_index = TileIndex(np.load(cache_path))
+    else:
+        tile_index = TileIndex.from_csv(path)
+        try:
+            tmp_path = cache_path + '.tmp.npy'
+            np.save(tmp_path, tile_index._tiles)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.debug(f'Could not cache the tile index to {cache_path}: {e}')
+    _tile_indexes[path] = tile_index
+    return tile_index
+
+
+class TileRouter:
+    # regions sharing a tile share its search, and the search results tell which regions every granule can cover
+
+    def __init__(self, tile_index, region_index):
+        self.tiles_by_region = tile_index.get_region_tiles(region_index)
+        self._regions_by_tile = OrderedDict()
+        for name, tiles in self.tiles_by_region.items():
+            for tile in tiles:
+                self._regions_by_tile.setdefault(tile, []).append(name)
+        self._names = list(self.tiles_by_region.keys())
+        self.routes = {}
+
+    @property
+    def tiles(self):
+        return sorted(self._regions_by_tile.keys())
+
+    def add(self, tile, granules):
+        for granule in granules:
+            names = set(self.routes.get(granule['file_name'], [])) | set(self._regions_by_tile[tile])
+            self.routes[granule['file_name']] = [name for name in self._names if name in names]
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+import os
+import numpy as np
+from pyhdf.SD import SD, SDC
+
+TAI_EPOCH = datetime(1993, 1, 1)
+SECONDS_PER_SCAN = 1.477
+# MOD04_L2 swaths are 203 x 135 pixels at 10 km, MOD04_3K swaths 676 x 451 pixels at 3 km
+PRODUCTS = {
+    'MOD04_L2': {'shape': (203, 135), 'resolution_km': 10.0, 'scans_per_row': 1 / 10},
+    'MOD04_3K': {'shape': (676, 451), 'resolution_km': 3.0, 'scans_per_row': 3 / 10}
+}
+AOD = {'type': SDC.INT16, 'units': 'None', 'scale_factor': 0.001, 'add_offset': 0.0, '_FillValue': -9999, 'valid_range': (-100, 5000)}
+FLAG = {'type': SDC.INT16, 'units': 'None', 'scale_factor': 1.0, 'add_offset': 0.0, '_FillValue': -9999, 'valid_range': (0, 3)}
+SDS = {
+    'MOD04_L2': [
+        ('Deep_Blue_Aerosol_Optical_Depth_550_Land_Best_Estimate', 'Deep Blue AOT at 0.55 micron for land with higher quality data (Quality flag=2,3)', AOD),
+        ('Deep_Blue_Aerosol_Optical_Depth_550_Land_STD', 'Deep Blue Standard deviation of AOT at 0.55 micron for land', AOD),
+        ('Deep_Blue_Aerosol_Optical_Depth_550_Land_QA_Flag', 'Deep Blue Aerosol Optical Depth 550 Land QA Flag', FLAG)
+    ],
+    'MOD04_3K': [
+        ('Optical_Depth_Land_And_Ocean', 'AOT at 0.55 micron for both ocean (Average) (Quality flag=1,2,3) and land (corrected) (Quality flag=3)', AOD),
+        ('Image_Optical_Depth_Land_And_Ocean', 'AOT at 0.55 micron for both ocean (Average) and land (corrected) with all quality data', AOD),
+        ('Corrected_Optical_Depth_Land', 'Retrieved AOT at three Land_Ocean_Aerosol_Wavelengths 0.47, 0.55, 0.66 micron', dict(AOD, solutions=3)),
+        ('Corrected_Optical_Depth_Land_wav2p1', 'Retrieved AOT at 2.1 micron', AOD),
+        ('Land_Ocean_Quality_Flag', 'Quality Flag for Land and ocean Aerosol retreivals 0 = Bad; 1 = Marginal; 2 = Good; 3 = Very Good', FLAG),
+        ('Land_sea_Flag', 'Land_sea_Flag(based on MOD03 Landsea mask 0 = Ocean, 1 = Land and Ephemeral water 2 = Coastal)', dict(FLAG, valid_range=(0, 2)))
+    ]
+}
+TOPOGRAPHY = ('Topographic_Altitude_Land', 'Averaged topographic altitude for Land', {'type': SDC.INT16, 'units': 'meters', 'scale_factor': 1.0, 'add_offset': 0.0, '_FillValue': -9999, 'valid_range': (0, 7000)})
+FILL_RATIO = 0.2
+
+def get_file_name(product, acquisition_time):
+    production = acquisition_time + timedelta(days=1)
+    return f'{product}.A{acquisition_time:%Y%j.%H%M}.061.{production:%Y%j%H%M%S}.hdf'
+
+def _get_coordinates(product, center):
+    rows, cols = PRODUCTS[product]['shape']
+    step = PRODUCTS[product]['resolution_km'] / 111.0
+    center_latitude, center_longitude = center
+    row_offsets = (np.arange(rows) - rows / 2)[:, None]
+    col_offsets = (np.arange(cols) - cols / 2)[None, :]
+    # a slightly tilted swath, so matching pixels do not form an axis aligned rectangle
+    latitudes = center_latitude + step * (row_offsets + 0.1 * col_offsets)
+    longitudes = center_longitude + step * (col_offsets - 0.1 * row_offsets) / np.cos(np.radians(latitudes))
+    return latitudes.astype(np.float32), longitudes.astype(np.float32)
+
+def _write_sds(dataset, name, values, sds_type, attributes):
+    sds = dataset.create(name, sds_type, values.shape)
+    sds[:] = values
+    for attribute, value in attributes.items():
+        if attribute == '_FillValue':
+            sds.setfillvalue(value)
+        else:
+            setattr(sds, attribute, value)
+    sds.endaccess()
+
+def _get_metadata(latitudes, longitudes):
+    bounds = (
+        ('NORTHBOUNDINGCOORDINATE', latitudes.max()),
+        ('SOUTHBOUNDINGCOORDINATE', latitudes.min()),
+        ('EASTBOUNDINGCOORDINATE', longitudes.max()),
+        ('WESTBOUNDINGCOORDINATE', longitudes.min())
+    )
+    return "\n".join([
+        f'OBJECT = {name}\n  NUM_VAL = 1\n  VALUE = {float(value)}\nEND_OBJECT = {name}' for name, value in bounds
+    ])
+
+def _get_values(rng, shape, sds_attributes):
+    low, high = sds_attributes['valid_range']
+    values = rng.integers(low, high + 1, size=shape, dtype=np.int16)
+    values[rng.random(shape) < FILL_RATIO] = sds_attributes['_FillValue']
+    return values
+
+def write_granule(full_path, product, center, acquisition_time, seed=0):
+    rng = np.random.default_rng(seed)
+    rows, cols = PRODUCTS[product]['shape']
+    latitudes, longitudes = _get_coordinates(product, center)
+    dataset = SD(full_path, SDC.WRITE | SDC.CREATE | SDC.TRUNC)
+    try:
+        geolocation = {'_FillValue': -999.0}
+        _write_sds(dataset, 'Latitude', latitudes, SDC.FLOAT32, dict(geolocation, long_name='Geodetic Latitude', units='Degrees_north'))
+        _write_sds(dataset, 'Longitude', longitudes, SDC.FLOAT32, dict(geolocation, long_name='Geodetic Longitude', units='Degrees_east'))
+        scan_start = (acquisition_time - TAI_EPOCH).total_seconds()
+        scan_times = scan_start + SECONDS_PER_SCAN * np.floor(np.arange(rows) * PRODUCTS[product]['scans_per_row'])
+        _write_sds(dataset, 'Scan_Start_Time', np.repeat(scan_times[:, None], cols, axis=1), SDC.FLOAT64, {
+            'long_name': 'TAI Time at Start of Scan replicated across the swath',
+            'units': 'Seconds since 1993-1-1 00:00:00.0 0',
+            '_FillValue': -999.0
+        })
+        for name, long_name, sds_attributes in SDS[product] + [TOPOGRAPHY]:
+            shape = (sds_attributes['solutions'], rows, cols) if 'solutions' in sds_attributes else (rows, cols)
+            attributes = dict([(key, value) for key, value in sds_attributes.items() if key not in ('type', 'solutions')])
+            attributes['valid_range'] = list(attributes['valid_range'])
+            _write_sds(dataset, name, _get_values(rng, shape, sds_attributes), sds_attributes['type'], dict(attributes, long_name=long_name))
+        setattr(dataset, 'ArchiveMetadata.0', _get_metadata(latitudes, longitudes))
+    finally:
+        dataset.end()
+    return full_path
+
+def generate_granules(dirname, product, count, center, start_time=datetime(2018, 10, 1, 10, 35)):
+    os.makedirs(dirname, exist_ok=True)
+    full_paths = []
+    for index in range(count):
+        acquisition_time = start_time + timedelta(days=index)
+        full_path = os.path.join(dirname, get_file_name(product, acquisition_time))
+        full_paths.append(write_granule(full_path, product, center, acquisition_time, seed=index))
+    return full_paths
@@ -0,0 +1,173 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+from benchmarks.granules import generate_granules, PRODUCTS
+from extractors import BaseModisExtractor
+from extractors.footprints import FootprintCache
+from extractors.aerosol_mod04_3k_extractor import AerosolM0D043KExtractor
+from extractors.aerosol_mod04_l2_extrator import AerosolMOD04L2Extractor
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+CENTER = (38.7, -9.1)
+BOX_SIZES = (0.5, 2.0, 8.0)
+GRANULE_COUNTS = (1, 8)
+REPEAT = 5
+TOLERANCE = 0.2
+EXTRACTORS = {
+    'MOD04_L2': (AerosolMOD04L2Extractor, 'Deep_Blue_Aerosol_Optical_Depth_550_Land_QA_Flag', AerosolMOD04L2Extractor.MIN_QA_FLAG),
+    'MOD04_3K': (AerosolM0D043KExtractor, 'Land_Ocean_Quality_Flag', AerosolM0D043KExtractor.MIN_QA_FLAG)
+}
+GRANULE_STAGES = ('get_matches', '_get_json_data', 'write_to_csv')
+STAGES = GRANULE_STAGES + ('process_files',)
+
+def get_box(size, center=CENTER):
+    latitude, longitude = center
+    return (latitude - size / 2, latitude + size / 2), (longitude - size / 2, longitude + size / 2)
+
+def get_case_key(product, stage, box_size, granule_count):
+    return f'{product}/{stage}/box={box_size}/granules={granule_count}'
+
+def _time(func, repeat, before=None):
+    # best of repeat runs, the minimum is the least noisy estimate of the cost of the code itself
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def _remove(path):
+    if os.path.isfile(path):
+        os.remove(path)
+
+def _run_case(product, stage, dirname, box_size, repeat):
+    extractor_class, qa_flag_name, min_qa_flag = EXTRACTORS[product]
+    extractor = extractor_class()
+    latitude_range, longitude_range = get_box(box_size)
+    full_paths = sorted([os.path.join(dirname, file) for file in os.listdir(dirname) if file.endswith('.hdf')])
+    out_file = os.path.join(dirname, f'{stage}.csv')
+    if stage == 'process_files':
+        seconds, _ = _time(
+            lambda: extractor.process_files(dirname, out_file, latitude_range, longitude_range, footprints=FootprintCache()),
+            repeat,
+            before=lambda: _remove(out_file)
+        )
+        with open(out_file) as f:
+            pixels = max(sum(1 for _ in f) - 1, 0)
+    else:
+        dataset = extractor._open_dataset(full_paths[0])
+        if stage == 'get_matches':
+            seconds, _ = _time(lambda: extractor.get_matches(dataset, latitude_range, longitude_range, qa_flag_name, min_qa_flag), repeat)
+            pixels = PRODUCTS[product]['shape'][0] * PRODUCTS[product]['shape'][1]
+        else:
+            seconds, data = _time(lambda: extractor._process_file(dataset, latitude_range, longitude_range), repeat)
+            pixels = data[0]
+            if stage == 'write_to_csv':
+                seconds, _ = _time(lambda: BaseModisExtractor.write_to_csv(out_file, ';', data), repeat, before=lambda: _remove(out_file))
+        dataset.end()
+    _remove(out_file)
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        'seconds': seconds,
+        'pixels': pixels,
+        'pixels_per_second': pixels / seconds if seconds > 0 else 0.0,
+        'peak_rss_mb': round(peak_rss_mb, 1)
+    }
+
+def run_benchmarks(workdir, products, box_sizes, granule_counts, repeat=REPEAT):
+    results = {}
+    for product in products:
+        for granule_count in sorted(set(granule_counts) | {1}):
+            dirname = os.path.join(workdir, product, str(granule_count))
+            generate_granules(dirname, product, granule_count, CENTER)
+        for box_size in box_sizes:
+            cases = [(stage, 1) for stage in GRANULE_STAGES] + [('process_files', count) for count in granule_counts]
+            for stage, granule_count in cases:
+                dirname = os.path.join(workdir, product, str(granule_count))
+                # every case runs in a fresh process, so peak RSS is not inflated by the previous ones
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(_run_case, product, stage, dirname, box_size, repeat).result()
+                key = get_case_key(product, stage, box_size, granule_count)
+                results[key] = result
+                print(f'{key:<55} {result["pixels"]:>9} px {result["seconds"] * 1000:>10.2f} ms {result["pixels_per_second"]:>14,.0f} px/s {result["peak_rss_mb"]:>8.1f} MB')
+    return results
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+def save_baseline(results, path=BASELINE_FILE):
+    baseline = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()
+        },
+        'results': results
+    }
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+
+def find_regressions(results, baseline, tolerance=TOLERANCE):
+    regressions = []
+    for key, result in results.items():
+        expected = baseline['results'].get(key)
+        if expected is None or expected['pixels_per_second'] == 0:
+            continue
+        ratio = result['pixels_per_second'] / expected['pixels_per_second']
+        if ratio < 1 - tolerance:
+            regressions.append((key, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark MODIS extraction on synthetic granules')
+    parser.add_argument('--products', default=','.join(PRODUCTS.keys()), help='comma separated products to benchmark')
+    parser.add_argument('--boxes', default=','.join([str(size) for size in BOX_SIZES]), help='comma separated box sizes in degrees')
+    parser.add_argument('--granules', default=','.join([str(count) for count in GRANULE_COUNTS]), help='comma separated granule counts for process_files')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='number of runs per case, the fastest one is reported')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file results are compared to')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed relative throughput drop before a case is reported as a regression')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='modis-benchmark-')
+    try:
+        results = run_benchmarks(
+            workdir,
+            args.products.split(','),
+            [float(size) for size in args.boxes.split(',')],
+            [int(count) for count in args.granules.split(',')],
+            args.repeat
+        )
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f'Baseline saved to {args.baseline}')
+    else:
+        baseline = load_baseline(args.baseline)
+        if baseline is None:
+            print(f'No baseline found at {args.baseline}, run with --save-baseline to create one')
+        else:
+            regressions = find_regressions(results, baseline, args.tolerance)
+            for key, ratio in regressions:
+                print(f'Regression: {key} runs at {ratio:.0%} of the baseline throughput')
+            if len(regressions) > 0:
+                raise SystemExit(1)
+            print(f'No regressions against {args.baseline}')
@@ -0,0 +1,27 @@
+import os
+import re
+from datetime import datetime
+
+ACQUISITION_PATTERN = re.compile(r'\.A(\d{7})\.(\d{4})\.')
+SENTINEL_ACQUISITION_PATTERN = re.compile(r'^S5P_\w{4}_\w{10}_(\d{8}T\d{6})_')
+# the downloader records the verified MD5 of a granule next to it
+CHECKSUM_SUFFIX = '.md5'
+
+def get_acquisition_time(file_name):
+    file_name = os.path.basename(file_name)
+    match = ACQUISITION_PATTERN.search(file_name)
+    if match is not None:
+        return datetime.strptime(match.group(1) + match.group(2), '%Y%j%H%M')
+    match = SENTINEL_ACQUISITION_PATTERN.search(file_name)
+    if match is not None:
+        return datetime.strptime(match.group(1), '%Y%m%dT%H%M%S')
+    return None
+
+def sort_by_acquisition_time(file_names):
+    return sorted(file_names, key=lambda name: (get_acquisition_time(name) or datetime.max, os.path.basename(name)))
+
+def remove_granule(full_path):
+    # the checksum goes with the granule, otherwise every deleted granule leaves its sidecar behind
+    os.remove(full_path)
+    if os.path.isfile(full_path + CHECKSUM_SUFFIX):
+        os.remove(full_path + CHECKSUM_SUFFIX)
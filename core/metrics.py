@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import json
+import os
+import threading
+import time
+
+# stage time is summed over threads, so a stage running on several download workers can report more seconds than the run
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profile_dir = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._started_at = datetime.now()
+            self._start = time.perf_counter()
+            self._stages = {}
+            self._counters = {}
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds, calls=1):
+        with self._lock:
+            timing = self._stages.setdefault(stage, {'seconds': 0.0, 'calls': 0})
+            timing['seconds'] += seconds
+            timing['calls'] += calls
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + int(value)
+
+    @contextmanager
+    def profile(self, name):
+        if self.profile_dir is None:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, os.path.basename(name) + '.prof'))
+
+    def merge(self, summary):
+        # extraction workers run in other processes and send their summary back with the extracted data
+        for stage, timing in summary['stages'].items():
+            self.add_time(stage, timing['seconds'], timing['calls'])
+        for counter, value in summary['counters'].items():
+            self.increment(counter, value)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'started_at': self._started_at.isoformat(timespec='seconds'),
+                'wall_seconds': round(time.perf_counter() - self._start, 3),
+                'stages': dict([
+                    (stage, {'seconds': round(timing['seconds'], 3), 'calls': timing['calls']})
+                    for stage, timing in sorted(self._stages.items())
+                ]),
+                'counters': dict(sorted(self._counters.items()))
+            }
+
+    def write_summary(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=4)
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,210 @@
+from contextlib import contextmanager
+from pathlib import Path
+import logging
+import socket
+import sqlite3
+import os
+import threading
+import time
+
+from api import API
+
+logger = logging.getLogger(__name__)
+
+class TaskStore:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    DEFAULT_LEASE_SECONDS = 300
+    DEFAULT_MAX_ATTEMPTS = 3
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            product TEXT NOT NULL,
+            region TEXT NOT NULL,
+            date_from TEXT NOT NULL,
+            date_to TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            heartbeat_at REAL,
+            output TEXT,
+            error TEXT
+        );
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # autocommit mode, claims take the database write lock themselves with BEGIN IMMEDIATE
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            self._connection.executescript(TaskStore.SCHEMA)
+
+    @property
+    def lease_seconds(self):
+        return self._lease_seconds
+
+    @staticmethod
+    def get_task_id(product, region, date_from):
+        return f'{product}/{region}/{date_from[:7]}'
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def add_tasks(self, product, region, date_from, date_to):
+        # one task per month, planning the same range again keeps the state of the existing tasks
+        added = 0
+        with self._transaction() as connection:
+            for month_from, month_to in API.split_by_month(date_from, date_to):
+                added += connection.execute(
+                    'INSERT OR IGNORE INTO tasks (task_id, product, region, date_from, date_to) VALUES (?, ?, ?, ?, ?)',
+                    (TaskStore.get_task_id(product, region, month_from), product, region, month_from, month_to)
+                ).rowcount
+        return added
+
+    def claim(self, worker):
+        # a running task whose worker stopped sending heartbeats is claimed again, or failed once out of attempts
+        now = time.time()
+        with self._transaction() as connection:
+            abandoned = connection.execute(
+                'UPDATE tasks SET status = ?, error = ? WHERE status = ? AND heartbeat_at < ? AND attempts >= ?',
+                (TaskStore.FAILED, 'Lease expired on the last attempt', TaskStore.RUNNING, now - self._lease_seconds, self._max_attempts)
+            ).rowcount
+            if abandoned > 0:
+                logger.warning(f'Failed {abandoned} tasks abandoned on their last attempt')
+            task = connection.execute(
+                'SELECT * FROM tasks WHERE attempts < ? AND (status = ? OR (status = ? AND heartbeat_at < ?)) '
+                'ORDER BY date_from, product, region LIMIT 1',
+                (self._max_attempts, TaskStore.PENDING, TaskStore.RUNNING, now - self._lease_seconds)
+            ).fetchone()
+            if task is None:
+                return None
+            if task['status'] == TaskStore.RUNNING:
+                logger.warning(f'Reclaiming task {task["task_id"]} abandoned by {task["worker"]}')
+            connection.execute(
+                'UPDATE tasks SET status = ?, attempts = attempts + 1, worker = ?, heartbeat_at = ?, error = NULL WHERE task_id = ?',
+                (TaskStore.RUNNING, worker, now, task['task_id'])
+            )
+        return dict(task, status=TaskStore.RUNNING, attempts=task['attempts'] + 1, worker=worker, heartbeat_at=now)
+
+    def heartbeat(self, task_id, worker):
+        # returns False once the task was reclaimed by another worker
+        with self._transaction() as connection:
+            return connection.execute(
+                'UPDATE tasks SET heartbeat_at = ? WHERE task_id = ? AND worker = ? AND status = ?',
+                (time.time(), task_id, worker, TaskStore.RUNNING)
+            ).rowcount == 1
+
+    def complete(self, task_id, worker, output=None):
+        with self._transaction() as connection:
+            return connection.execute(
+                'UPDATE tasks SET status = ?, output = ?, heartbeat_at = ? WHERE task_id = ? AND worker = ? AND status = ?',
+                (TaskStore.DONE, output, time.time(), task_id, worker, TaskStore.RUNNING)
+            ).rowcount == 1
+
+    def fail(self, task_id, worker, error):
+        with self._transaction() as connection:
+            return connection.execute(
+                'UPDATE tasks SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, error = ?, heartbeat_at = ? '
+                'WHERE task_id = ? AND worker = ? AND status = ?',
+                (self._max_attempts, TaskStore.PENDING, TaskStore.FAILED, str(error), time.time(), task_id, worker, TaskStore.RUNNING)
+            ).rowcount == 1
+
+    def reset_failed(self):
+        with self._transaction() as connection:
+            return connection.execute(
+                'UPDATE tasks SET status = ?, attempts = 0 WHERE status = ?', (TaskStore.PENDING, TaskStore.FAILED)
+            ).rowcount
+
+    def get_tasks(self, product=None, region=None, status=None):
+        conditions = [(column, value) for column, value in (('product', product), ('region', region), ('status', status)) if value is not None]
+        where = ' AND '.join([f'{column} = ?' for column, _ in conditions])
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(
+                'SELECT * FROM tasks' + (f' WHERE {where}' if len(where) > 0 else '') + ' ORDER BY product, region, date_from',
+                [value for _, value in conditions]
+            )]
+
+    def get_counts(self):
+        with self._lock:
+            return dict([(row['status'], row['count']) for row in self._connection.execute(
+                'SELECT status, COUNT(*) AS count FROM tasks GROUP BY status ORDER BY status'
+            )])
+
+    def close(self):
+        self._connection.close()
+
+
+class Heartbeat:
+    # keeps the lease of a claimed task alive from a background thread while the task runs
+
+    def __init__(self, store, task_id, worker, interval):
+        self._store = store
+        self._task_id = task_id
+        self._worker = worker
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        # set once the task was reclaimed by another worker, the task should stop as soon as it notices
+        self.lost = threading.Event()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            if not self._store.heartbeat(self._task_id, self._worker):
+                logger.warning(f'Lost the lease of task {self._task_id}')
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+
+
+def get_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+def run_worker(store, run_task, worker=None, heartbeat_interval=None):
+    # claims tasks until none is left, run_task(task, lost) returns the output of the task, usually the path of its shard,
+    # and stops early by raising once the lost event is set
+    worker = API.get_default_if_empty(worker, get_worker_id())
+    heartbeat_interval = API.get_default_if_empty(heartbeat_interval, store.lease_seconds / 3)
+    completed = 0
+    while True:
+        task = store.claim(worker)
+        if task is None:
+            break
+        logger.info(f'{worker} claimed {task["task_id"]} (attempt {task["attempts"]})')
+        heartbeat = Heartbeat(store, task['task_id'], worker, heartbeat_interval)
+        try:
+            with heartbeat:
+                output = run_task(task, heartbeat.lost)
+        except Exception as e:
+            if heartbeat.lost.is_set():
+                logger.warning(f'{worker} stopped {task["task_id"]} after losing its lease: {e}')
+                continue
+            logger.exception(f'Task {task["task_id"]} failed')
+            store.fail(task['task_id'], worker, e)
+            continue
+        if store.complete(task['task_id'], worker, output):
+            completed += 1
+            logger.info(f'{worker} completed {task["task_id"]}')
+        else:
+            logger.warning(f'{worker} finished {task["task_id"]} after losing its lease, the result is discarded')
+    return completed
@@ -0,0 +1,32 @@
+from datetime import datetime
+from pathlib import Path
+import json
+import os
+
+class WatermarkStore:
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    def __init__(self, path):
+        self._path = path
+        self._watermarks = {}
+        if os.path.isfile(path):
+            with open(path) as state_file:
+                self._watermarks = json.load(state_file)
+
+    def get(self, product, region):
+        watermark = self._watermarks.get(product, {}).get(region)
+        return None if watermark is None else datetime.strptime(watermark, WatermarkStore.TIME_FORMAT)
+
+    def update(self, product, region, acquisition_time):
+        current = self.get(product, region)
+        if acquisition_time is None or (current is not None and current >= acquisition_time):
+            return
+        self._watermarks.setdefault(product, {})[region] = acquisition_time.strftime(WatermarkStore.TIME_FORMAT)
+        self._save()
+
+    def _save(self):
+        Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self._watermarks, state_file, indent=4)
+        os.replace(tmp_path, self._path)
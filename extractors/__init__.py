@@ -1,68 +1,361 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+import functools
+import logging
 import os
 import numpy as np
 from pyhdf.SD import *
+from netCDF4 import Dataset
+
+from core.granules import remove_granule, sort_by_acquisition_time
+from core.metrics import metrics
+from extractors.columns import ColumnSpec
+from extractors.sinks import CsvSink, after_commit
+from extractors.footprints import FootprintCache, read_hdf_footprint, read_netcdf_footprint
+
+logger = logging.getLogger(__name__)
+
+def _extract_granule(extractor_class, full_path, latitude_range, longitude_range, region=None, profile_dir=None):
+    # runs in a worker process, so every worker opens its own file handle and sends its metrics back with the data
+    metrics.reset()
+    metrics.profile_dir = profile_dir
+    data = extractor_class()._extract(full_path, latitude_range, longitude_range, region)
+    return data, metrics.summary()
+
+def _extract_granule_by_region(extractor_class, full_path, region_index, profile_dir=None):
+    metrics.reset()
+    metrics.profile_dir = profile_dir
+    data_by_region = extractor_class()._extract_by_region(full_path, region_index)
+    return data_by_region, metrics.summary()
 
 class BaseModisExtractor:
+    FILE_EXTENSION = '.hdf'
+    LATITUDE_NAME = 'Latitude'
+    LONGITUDE_NAME = 'Longitude'
+
+    @property
+    def read_plan(self):
+        return self._read_plan
+
+    def _open_dataset(self, full_path):
+        return SD(full_path, SDC.READ)
+
+    def _select(self, dataset, name):
+        return dataset.select(name)
+
+    def _read(self, dataset, name):
+        return dataset.select(name).get()
+
+    def _read_window(self, data, window):
+        return BaseModisExtractor.read_window(data, window)
+
+    def _get_attributes(self, data):
+        return data.attributes()
+
+    @staticmethod
+    def physical(sds_name, solutions=None):
+        # scaled integers are decoded to float32 with fill values as NaN, which keeps the precision of the stored data
+        return ColumnSpec(sds_name, solutions=solutions, dtype=np.float32, decode=True, mask_fill=True)
+
+    def read_footprint(self, full_path):
+        return read_hdf_footprint(full_path)
 
-    def get_matches(self, dataset, latitude_range, longitude_range, qa_flag_name, min_qa_flag):
+    def get_matches(self, dataset, latitude_range, longitude_range, qa_flag_name, min_qa_flag, region=None):
         min_latitude, max_latitude = latitude_range
         min_longitude, max_longitude = longitude_range
-        longitude_values = dataset.select('Longitude').get()
-        latitude_values = dataset.select('Latitude').get()
-        qa_flags = dataset.select(qa_flag_name).get()
-        matches_latitude = (latitude_values > min_latitude) & (latitude_values < max_latitude)
-        matches_longitude = (longitude_values > min_longitude) & (longitude_values < max_longitude)
-        matches_qa = qa_flags >= min_qa_flag
-        matches_all = matches_latitude & matches_longitude & matches_qa
-        return np.argwhere(matches_all)
-
-    def _get_json_data(self, dataset, data_instructions, latitude_range, longitude_range, qa_flag_name, min_qa_flag):
-        matches_all_indexes = self.get_matches(dataset, latitude_range, longitude_range, qa_flag_name, min_qa_flag)
-        res = {}
-        for name, instructions in data_instructions.items():
-            print(f'Start processing... {name}')
-            data = dataset.select(name)
-            data_values = data.get()
-            col_name = instructions['column_name_func'](data)
-            col_unit = instructions['units_func'](data)
-            transform_func = instructions['value_transform_func']
-            if "solutions" in instructions:
-                for sol_key, sol_name in instructions['solutions'].items():
-                    final_name = f'{col_name} ({sol_name}, {col_unit})'
-                    res[final_name] = transform_func([data_values[sol_key, index[0], index[1]] for index in matches_all_indexes])
-                    
+        with metrics.timer('read_geolocation'):
+            longitude_values = self._read(dataset, self.LONGITUDE_NAME)
+            latitude_values = self._read(dataset, self.LATITUDE_NAME)
+        with metrics.timer('match'):
+            if region is None:
+                matches_latitude = (latitude_values > min_latitude) & (latitude_values < max_latitude)
+                matches_longitude = (longitude_values > min_longitude) & (longitude_values < max_longitude)
+                matches_location = matches_latitude & matches_longitude
             else:
-                res[f'{col_name} ({col_unit})'] = transform_func([data_values[index[0], index[1]] for index in matches_all_indexes])
-            
-        print(f'Finished processing... {name}')
-        return len(matches_all_indexes), res
+                matches_location = region.contains(latitude_values, longitude_values)
+            window = BaseModisExtractor.get_window(matches_location)
+            if window is None:
+                return None, (np.array([], dtype=np.intp), np.array([], dtype=np.intp))
+            row_start, row_stop, col_start, col_stop = window
+            qa_flags = self._read_window(self._select(dataset, qa_flag_name), window)
+            matches_qa = qa_flags >= min_qa_flag
+            matches_all = matches_location[row_start:row_stop, col_start:col_stop] & matches_qa
+            return window, np.nonzero(matches_all)
+
+    @staticmethod
+    def get_window(mask):
+        matching_rows = np.flatnonzero(mask.any(axis=1))
+        if len(matching_rows) == 0:
+            return None
+        matching_cols = np.flatnonzero(mask.any(axis=0))
+        return matching_rows[0], matching_rows[-1] + 1, matching_cols[0], matching_cols[-1] + 1
+
+    @staticmethod
+    def read_window(data, window):
+        row_start, row_stop, col_start, col_stop = [int(bound) for bound in window]
+        _, rank, dims, _, _ = data.info()
+        if rank == 3:
+            return data.get(start=(0, row_start, col_start), count=(dims[0], row_stop - row_start, col_stop - col_start))
+        return data.get(start=(row_start, col_start), count=(row_stop - row_start, col_stop - col_start))
+
+    def _get_json_data(self, dataset, read_plan, latitude_range, longitude_range, qa_flag_name, min_qa_flag, region=None):
+        window, (rows, cols) = self.get_matches(dataset, latitude_range, longitude_range, qa_flag_name, min_qa_flag, region)
+        metrics.increment('pixels_matched', len(rows))
+        if len(rows) == 0:
+            logger.debug('No matching pixels, skipping data read')
+            return 0, {}
+        return len(rows), self._read_columns(dataset, read_plan, window, [(rows, cols)])[0]
+
+    def _get_json_data_by_region(self, dataset, read_plan, region_index, qa_flag_name, min_qa_flag):
+        with metrics.timer('read_geolocation'):
+            latitude_values = self._read(dataset, self.LATITUDE_NAME)
+            longitude_values = self._read(dataset, self.LONGITUDE_NAME)
+        with metrics.timer('match'):
+            pixels_by_region = region_index.assign(latitude_values, longitude_values)
+            matches_location = np.zeros(latitude_values.size, dtype=bool)
+            for pixels in pixels_by_region.values():
+                matches_location[pixels] = True
+            window = BaseModisExtractor.get_window(matches_location.reshape(latitude_values.shape))
+            if window is None:
+                logger.debug('No matching pixels in any region, skipping data read')
+                return dict([(name, (0, {})) for name in pixels_by_region.keys()])
+            row_start, _, col_start, _ = window
+            matches_qa = self._read_window(self._select(dataset, qa_flag_name), window) >= min_qa_flag
+            region_pixels = []
+            for pixels in pixels_by_region.values():
+                rows, cols = np.unravel_index(pixels, latitude_values.shape)
+                rows, cols = rows - row_start, cols - col_start
+                matches = matches_qa[rows, cols]
+                region_pixels.append((rows[matches], cols[matches]))
+        metrics.increment('pixels_matched', sum([len(rows) for rows, _ in region_pixels]))
+        results = self._read_columns(dataset, read_plan, window, region_pixels)
+        return dict([
+            (name, (len(rows), res) if len(rows) > 0 else (0, {})) 
+            for name, (rows, _), res in zip(pixels_by_region.keys(), region_pixels, results)
+        ])
+
+    def _read_columns(self, dataset, read_plan, window, pixels):
+        # every SDS window is read once and its attributes are decoded once, then gathered for each set of pixels
+        results = [{} for _ in pixels]
+        for column in read_plan.columns:
+            logger.debug(f'Start processing... {column.sds_name}')
+            data = self._select(dataset, column.sds_name)
+            with metrics.timer('read_sds'):
+                data_values = self._read_window(data, window)
+            attributes = self._get_attributes(data)
+            names = column.get_names(attributes)
+            for res, (rows, cols) in zip(results, pixels):
+                for name, values in zip(names, column.gather(data_values, rows, cols)):
+                    res[name] = column.decode(values, attributes)
+        logger.debug(f'Finished processing... {len(read_plan.columns)} columns')
+        return results
 
     @staticmethod
     def write_to_csv(filename, separator, data):
-        data_length, json_data = data
-        if not os.path.isfile(filename):
-            with open(filename, mode='w') as f:
-                f.write(separator.join(json_data.keys()) + "\n")
-        with open(filename, mode='a') as f:
-            for index in range(data_length):
-                f.write(separator.join([str(product[index]) for product in json_data.values()]) + "\n")
-
-    def _process_file(self, dataset, latitude_range, longitude_range):
+        with CsvSink(filename, separator) as sink:
+            BaseModisExtractor._write(sink, data)
+
+    @staticmethod
+    def _write(sink, data):
+        with metrics.timer('write'):
+            sink.write(data)
+        metrics.increment('rows_written', data[0])
+
+    @staticmethod
+    def _finish_files(all_paths, position, full_path, sinks, delete_after, on_processed):
+        # granules are finished in acquisition order, together with the granules skipped before full_path.
+        # The caller records progress only once the sinks have committed the rows, so a killed run neither skips
+        # nor writes twice the rows of any granule. A granule deleted before that is just downloaded again.
+        stop = len(all_paths) if full_path is None else all_paths.index(full_path, position) + 1
+        for path in all_paths[position:stop]:
+            if on_processed is not None:
+                after_commit(sinks, functools.partial(on_processed, path))
+            if delete_after:
+                remove_granule(path)
+        return stop
+
+    def _extract(self, full_path, latitude_range, longitude_range, region=None):
+        with metrics.profile(full_path):
+            with metrics.timer('open'):
+                dataset = self._open_dataset(full_path)
+            data = self._process_file(dataset, latitude_range, longitude_range, region)
+        metrics.increment('granules_processed')
+        return data
+
+    def _extract_by_region(self, full_path, region_index):
+        with metrics.profile(full_path):
+            with metrics.timer('open'):
+                dataset = self._open_dataset(full_path)
+            data_by_region = self._process_file_by_region(dataset, region_index)
+        metrics.increment('granules_processed')
+        return data_by_region
+
+    def _process_file(self, dataset, latitude_range, longitude_range, region=None):
+        raise NotImplementedError('This method should be implemented by concrete extractor')
+
+    def _process_file_by_region(self, dataset, region_index):
         raise NotImplementedError('This method should be implemented by concrete extractor')
 
-    def process_files(self, dirname, out_file, latitude_range, longitude_range, csv_separator=";", delete_after=False):
-        file_index = 1
-        for file in os.listdir(dirname):
-            full_path = os.path.join(dirname, file)
-            if file.endswith('.hdf'):
-                print(f'Processing file... {file_index} (Path: {full_path})')
-                data = self._process_file(SD(full_path, SDC.READ), latitude_range, longitude_range)
+    def process_file(self, full_path, out_file, latitude_range, longitude_range, csv_separator=";", sink=None, footprints=None, region=None, on_processed=None):
+        footprints = FootprintCache() if footprints is None else footprints
+        if len(footprints.filter([full_path], latitude_range, longitude_range, self.read_footprint)) == 0:
+            logger.info(f'Skipped granule outside of the area (Path: {full_path})')
+        else:
+            data = self._extract(full_path, latitude_range, longitude_range, region)
+            if sink is None:
                 BaseModisExtractor.write_to_csv(out_file, csv_separator, data)
-                print(f'Processing finished for file... {file_index} (Path: {full_path})')
-        if delete_after:
-            for file in os.listdir(dirname):
-                full_path = os.path.join(dirname, file)
-                if file.endswith('.hdf'):
-                    os.remove(full_path)
-        print(f'All results saved to {out_file}')
+            else:
+                BaseModisExtractor._write(sink, data)
+        BaseModisExtractor._finish_files([full_path], 0, full_path, [] if sink is None else [sink], False, on_processed)
+
+    def _extract_files(self, full_paths, latitude_range, longitude_range, workers, region=None):
+        if workers <= 1:
+            for full_path in full_paths:
+                yield full_path, self._extract(full_path, latitude_range, longitude_range, region)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _extract_granule,
+                [type(self)] * len(full_paths),
+                full_paths,
+                [latitude_range] * len(full_paths),
+                [longitude_range] * len(full_paths),
+                [region] * len(full_paths),
+                [metrics.profile_dir] * len(full_paths)
+            )
+            # map yields in submission order, which keeps the output sorted by acquisition time
+            for full_path, (data, summary) in zip(full_paths, results):
+                metrics.merge(summary)
+                yield full_path, data
+
+    def process_files(self, dirname, out_file, latitude_range, longitude_range, csv_separator=";", delete_after=False, workers=1, sink=None, footprints=None, region=None, on_processed=None):
+        files = sort_by_acquisition_time([file for file in os.listdir(dirname) if file.endswith(self.FILE_EXTENSION)])
+        all_paths = [os.path.join(dirname, file) for file in files]
+        footprints = FootprintCache() if footprints is None else footprints
+        full_paths = footprints.filter(all_paths, latitude_range, longitude_range, self.read_footprint)
+        footprints.save()
+        logger.info(f'Skipped {len(all_paths) - len(full_paths)}/{len(all_paths)} granules outside of the area')
+        output = CsvSink(out_file, csv_separator) if sink is None else sink
+        position = 0
+        try:
+            for file_index, (full_path, data) in enumerate(self._extract_files(full_paths, latitude_range, longitude_range, workers, region), 1):
+                BaseModisExtractor._write(output, data)
+                position = BaseModisExtractor._finish_files(all_paths, position, full_path, [output], delete_after, on_processed)
+                logger.info(f'Processing finished for file... {file_index}/{len(full_paths)} (Path: {full_path})')
+            BaseModisExtractor._finish_files(all_paths, position, None, [output], delete_after, on_processed)
+        finally:
+            if sink is None:
+                output.close()
+        logger.info(f'All results saved to {output.filename}')
+
+    def process_file_by_region(self, full_path, region_index, sinks, footprints=None, routes=None, on_processed=None):
+        routed_index = BaseModisExtractor._route(full_path, region_index, routes)
+        footprints = FootprintCache() if footprints is None else footprints
+        if len(routed_index.names) == 0:
+            logger.info(f'Skipped granule not routed to any region (Path: {full_path})')
+        elif len(footprints.filter([full_path], routed_index.latitude_range, routed_index.longitude_range, self.read_footprint)) == 0:
+            logger.info(f'Skipped granule outside of all regions (Path: {full_path})')
+        else:
+            data_by_region = self._extract_by_region(full_path, routed_index)
+            for name, data in data_by_region.items():
+                BaseModisExtractor._write(sinks[name], data)
+        BaseModisExtractor._finish_files([full_path], 0, full_path, sinks.values(), False, on_processed)
+
+    def _extract_files_by_region(self, full_paths, region_indexes, workers):
+        if workers <= 1:
+            for full_path, region_index in zip(full_paths, region_indexes):
+                yield full_path, self._extract_by_region(full_path, region_index)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _extract_granule_by_region,
+                [type(self)] * len(full_paths),
+                full_paths,
+                region_indexes,
+                [metrics.profile_dir] * len(full_paths)
+            )
+            for full_path, (data_by_region, summary) in zip(full_paths, results):
+                metrics.merge(summary)
+                yield full_path, data_by_region
+
+    @staticmethod
+    def _route(full_path, region_index, routes):
+        # granules missing from the routes were not found by a tile search, they are matched against every region
+        if routes is None or os.path.basename(full_path) not in routes:
+            return region_index
+        return region_index.subset(routes[os.path.basename(full_path)])
+
+    def process_files_by_region(self, dirname, region_index, sinks, delete_after=False, workers=1, footprints=None, routes=None, on_processed=None):
+        files = sort_by_acquisition_time([file for file in os.listdir(dirname) if file.endswith(self.FILE_EXTENSION)])
+        all_paths = [os.path.join(dirname, file) for file in files]
+        # routing by search tiles needs no file access, the footprints are only read for granules routed to a region
+        index_by_path = dict([(full_path, BaseModisExtractor._route(full_path, region_index, routes)) for full_path in all_paths])
+        routed_paths = [full_path for full_path in all_paths if len(index_by_path[full_path].names) > 0]
+        footprints = FootprintCache() if footprints is None else footprints
+        full_paths = footprints.filter(routed_paths, region_index.latitude_range, region_index.longitude_range, self.read_footprint)
+        footprints.save()
+        logger.info(f'Skipped {len(all_paths) - len(full_paths)}/{len(all_paths)} granules outside of all regions')
+        region_indexes = [index_by_path[full_path] for full_path in full_paths]
+        position = 0
+        for file_index, (full_path, data_by_region) in enumerate(self._extract_files_by_region(full_paths, region_indexes, workers), 1):
+            for name, data in data_by_region.items():
+                BaseModisExtractor._write(sinks[name], data)
+            position = BaseModisExtractor._finish_files(all_paths, position, full_path, sinks.values(), delete_after, on_processed)
+            logger.info(f'Processing finished for file... {file_index}/{len(full_paths)} (Path: {full_path})')
+        BaseModisExtractor._finish_files(all_paths, position, None, sinks.values(), delete_after, on_processed)
+        logger.info(f'All results saved to {", ".join([sink.filename for sink in sinks.values()])}')
+
+
+class BaseSentinel5PExtractor(BaseModisExtractor):
+    FILE_EXTENSION = '.nc'
+    LATITUDE_NAME = 'latitude'
+    LONGITUDE_NAME = 'longitude'
+    PRODUCT_GROUP = 'PRODUCT'
+    GROUND_PIXEL_DIMENSION = 'ground_pixel'
+
+    def _open_dataset(self, full_path):
+        return Dataset(full_path)[self.PRODUCT_GROUP]
+
+    def _select(self, dataset, name):
+        return dataset[name]
+
+    def _read(self, dataset, name):
+        return self._read_window(dataset[name], None)
+
+    def _read_window(self, data, window):
+        # netCDF4 only reads the requested hyperslab, the leading time dimension always has a single step
+        if window is None:
+            rows, cols = slice(None), slice(None)
+            col_count = data.group().dimensions[self.GROUND_PIXEL_DIMENSION].size
+        else:
+            row_start, row_stop, col_start, col_stop = [int(bound) for bound in window]
+            rows, cols = slice(row_start, row_stop), slice(col_start, col_stop)
+            col_count = col_stop - col_start
+        if self.GROUND_PIXEL_DIMENSION in data.dimensions:
+            return BaseSentinel5PExtractor._fill_masked(data[0, rows, cols])
+        # per scanline variables such as time_utc are broadcast over the ground pixels
+        values = BaseSentinel5PExtractor._fill_masked(data[0, rows])
+        return np.broadcast_to(values[:, None], (len(values), col_count))
+
+    @staticmethod
+    def _fill_masked(values):
+        if not np.ma.isMaskedArray(values):
+            return np.asarray(values)
+        if np.issubdtype(values.dtype, np.floating):
+            return values.filled(np.nan)
+        return values.data
+
+    def _get_attributes(self, data):
+        # netCDF4 already applies scale_factor, add_offset and _FillValue while reading, so they must not be applied twice
+        decoded = ('scale_factor', 'add_offset', '_FillValue', 'valid_range', 'valid_min', 'valid_max')
+        return dict([(name, data.getncattr(name)) for name in data.ncattrs() if name not in decoded])
+
+    def read_footprint(self, full_path):
+        return read_netcdf_footprint(full_path)
+
+    @staticmethod
+    def parse_utc_times(values):
+        values = np.asarray(values)
+        unique_values, inverse = np.unique(values.astype(str), return_inverse=True)
+        unique_times = np.char.rstrip(unique_values, 'Z').astype('datetime64[us]')
+        return unique_times[inverse].reshape(values.shape)
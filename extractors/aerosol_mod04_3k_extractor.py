@@ -1,4 +1,5 @@
 from extractors import BaseModisExtractor
+from extractors.columns import ColumnSpec, ReadPlan
 
 import numpy as np
 from datetime import datetime
@@ -20,74 +21,43 @@ class AerosolM0D043KExtractor(BaseModisExtractor):
     }
 
     def __init__(self):
-        self._extractor_config = AerosolM0D043KExtractor.get_extractor_config()
+        self._read_plan = ReadPlan(AerosolM0D043KExtractor.get_extractor_config())
 
-    def _process_file(self, dataset, latitude_range, longitude_range):
+    def _process_file(self, dataset, latitude_range, longitude_range, region=None):
         return super()._get_json_data(
             dataset=dataset,
-            data_instructions=self._extractor_config,
+            read_plan=self._read_plan,
             latitude_range=latitude_range,
             longitude_range=longitude_range,
             qa_flag_name='Land_Ocean_Quality_Flag',
+            min_qa_flag=AerosolM0D043KExtractor.MIN_QA_FLAG,
+            region=region
+        )
+
+    def _process_file_by_region(self, dataset, region_index):
+        return super()._get_json_data_by_region(
+            dataset=dataset,
+            read_plan=self._read_plan,
+            region_index=region_index,
+            qa_flag_name='Land_Ocean_Quality_Flag',
             min_qa_flag=AerosolM0D043KExtractor.MIN_QA_FLAG
         )
 
     @staticmethod
     def get_extractor_config():
-        return {
-            'Scan_Start_Time': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: 'Time UTC+0',
-                'value_transform_func': lambda xs: list(map(lambda x: AerosolM0D043KExtractor.START_TIME + np.timedelta64(int(x), 's'), xs))
-            },
-            'Latitude': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            },
-            'Longitude': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            },
-            'Optical_Depth_Land_And_Ocean': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            },
-            'Image_Optical_Depth_Land_And_Ocean': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x  
-            },
-            'Corrected_Optical_Depth_Land': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x,
-                'solutions': {
-                    0: '0.47 microns',
-                    1: '0.55 microns',
-                    2: '0.66 microns'
-                }
-            },
-            'Corrected_Optical_Depth_Land_wav2p1': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x  
-            },
-            'Land_Ocean_Quality_Flag': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: [f'{i} ({AerosolM0D043KExtractor.QUALITY_FLAGS[i]})' for i in x]
-            },
-            'Land_sea_Flag': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: [f'{i} ({AerosolM0D043KExtractor.LAND_FLAGS[i]})' for i in x]
-            },
-            'Topographic_Altitude_Land': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            }
-        }
\ No newline at end of file
+        return [
+            ColumnSpec('Scan_Start_Time', units='Time UTC+0', epoch=AerosolM0D043KExtractor.START_TIME, mask_fill=True),
+            ColumnSpec('Latitude', dtype=np.float32, mask_fill=True),
+            ColumnSpec('Longitude', dtype=np.float32, mask_fill=True),
+            AerosolM0D043KExtractor.physical('Optical_Depth_Land_And_Ocean'),
+            AerosolM0D043KExtractor.physical('Image_Optical_Depth_Land_And_Ocean'),
+            AerosolM0D043KExtractor.physical('Corrected_Optical_Depth_Land', solutions={
+                0: '0.47 microns',
+                1: '0.55 microns',
+                2: '0.66 microns'
+            }),
+            AerosolM0D043KExtractor.physical('Corrected_Optical_Depth_Land_wav2p1'),
+            ColumnSpec('Land_Ocean_Quality_Flag', categories=AerosolM0D043KExtractor.QUALITY_FLAGS),
+            ColumnSpec('Land_sea_Flag', categories=AerosolM0D043KExtractor.LAND_FLAGS),
+            AerosolM0D043KExtractor.physical('Topographic_Altitude_Land')
+        ]
@@ -1,4 +1,5 @@
 from extractors import BaseModisExtractor
+from extractors.columns import ColumnSpec, ReadPlan
 
 import numpy as np
 from datetime import datetime
@@ -14,54 +15,36 @@ class AerosolMOD04L2Extractor(BaseModisExtractor):
     }
     
     def __init__(self):
-        self._extractor_config = AerosolMOD04L2Extractor.get_extractor_config()
+        self._read_plan = ReadPlan(AerosolMOD04L2Extractor.get_extractor_config())
 
-    def _process_file(self, dataset, latitude_range, longitude_range):
+    def _process_file(self, dataset, latitude_range, longitude_range, region=None):
         return super()._get_json_data(
             dataset=dataset,
-            data_instructions=self._extractor_config,
+            read_plan=self._read_plan,
             latitude_range=latitude_range,
             longitude_range=longitude_range,
             qa_flag_name='Deep_Blue_Aerosol_Optical_Depth_550_Land_QA_Flag',
+            min_qa_flag=AerosolMOD04L2Extractor.MIN_QA_FLAG,
+            region=region
+        )
+
+    def _process_file_by_region(self, dataset, region_index):
+        return super()._get_json_data_by_region(
+            dataset=dataset,
+            read_plan=self._read_plan,
+            region_index=region_index,
+            qa_flag_name='Deep_Blue_Aerosol_Optical_Depth_550_Land_QA_Flag',
             min_qa_flag=AerosolMOD04L2Extractor.MIN_QA_FLAG
         )
 
     @staticmethod
     def get_extractor_config():
-        return {
-            'Scan_Start_Time': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: 'Time UTC+0',
-                'value_transform_func': lambda xs: list(map(lambda x: AerosolMOD04L2Extractor.START_TIME + np.timedelta64(int(x), 's'), xs))
-            },
-            'Latitude': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            },
-            'Longitude': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            },
-            'Deep_Blue_Aerosol_Optical_Depth_550_Land_Best_Estimate': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            },
-            'Deep_Blue_Aerosol_Optical_Depth_550_Land_STD': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x  
-            },
-            'Deep_Blue_Aerosol_Optical_Depth_550_Land_QA_Flag': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            },
-            'Topographic_Altitude_Land': {
-                'column_name_func': lambda x: x.long_name,
-                'units_func': lambda x: x.units,
-                'value_transform_func': lambda x: x
-            }
-        }
\ No newline at end of file
+        return [
+            ColumnSpec('Scan_Start_Time', units='Time UTC+0', epoch=AerosolMOD04L2Extractor.START_TIME, mask_fill=True),
+            ColumnSpec('Latitude', dtype=np.float32, mask_fill=True),
+            ColumnSpec('Longitude', dtype=np.float32, mask_fill=True),
+            AerosolMOD04L2Extractor.physical('Deep_Blue_Aerosol_Optical_Depth_550_Land_Best_Estimate'),
+            AerosolMOD04L2Extractor.physical('Deep_Blue_Aerosol_Optical_Depth_550_Land_STD'),
+            ColumnSpec('Deep_Blue_Aerosol_Optical_Depth_550_Land_QA_Flag'),
+            AerosolMOD04L2Extractor.physical('Topographic_Altitude_Land')
+        ]
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+
+from extractors.sinks import OutputSink, resolve_column
+
+class GridAggregator(OutputSink):
+    LATITUDE_COLUMN = 'Geodetic Latitude'
+    LONGITUDE_COLUMN = 'Geodetic Longitude'
+    TIME_COLUMN = 'TAI Time at Start of Scan'
+
+    def __init__(self,
+                filename,
+                value_column,
+                latitude_range,
+                longitude_range,
+                resolution=0.05,
+                fill_value=None,
+                variable_name='aod',
+                latitude_column=LATITUDE_COLUMN,
+                longitude_column=LONGITUDE_COLUMN,
+                time_column=TIME_COLUMN,
+                read_plan=None):
+        self._filename = filename
+        self._requested_columns = (value_column, latitude_column, longitude_column, time_column)
+        self._columns = None
+        self._read_plan = read_plan
+        self._latitude_range = latitude_range
+        self._longitude_range = longitude_range
+        self._resolution = resolution
+        self._rows = int(np.ceil((latitude_range[1] - latitude_range[0]) / resolution))
+        self._cols = int(np.ceil((longitude_range[1] - longitude_range[0]) / resolution))
+        self._fill_value = fill_value
+        self._variable_name = variable_name
+        self._days = {}
+
+    def _get_accumulators(self, day):
+        if day not in self._days:
+            cells = self._rows * self._cols
+            self._days[day] = {
+                'count': np.zeros(cells, dtype=np.int64),
+                'sum': np.zeros(cells, dtype=np.float64),
+                'sum_squares': np.zeros(cells, dtype=np.float64),
+                'min': np.full(cells, np.inf),
+                'max': np.full(cells, -np.inf)
+            }
+        return self._days[day]
+
+    def write(self, data):
+        data_length, json_data = data
+        if data_length == 0:
+            return
+        if self._columns is None:
+            self._columns = [resolve_column(name, list(json_data.keys()), self._read_plan) for name in self._requested_columns]
+        value_column, latitude_column, longitude_column, time_column = self._columns
+        values = np.asarray(json_data[value_column], dtype=np.float64)
+        latitudes = np.asarray(json_data[latitude_column], dtype=np.float64)
+        longitudes = np.asarray(json_data[longitude_column], dtype=np.float64)
+        days = np.asarray(json_data[time_column]).astype('datetime64[D]')
+        rows = np.floor((latitudes - self._latitude_range[0]) / self._resolution).astype(np.int64)
+        cols = np.floor((longitudes - self._longitude_range[0]) / self._resolution).astype(np.int64)
+        valid = ~np.isnan(values) & ~np.isnat(days) & (rows >= 0) & (rows < self._rows) & (cols >= 0) & (cols < self._cols)
+        if self._fill_value is not None:
+            valid &= values != self._fill_value
+        values, days, cells = values[valid], days[valid], (rows * self._cols + cols)[valid]
+        for day in np.unique(days):
+            in_day = days == day
+            self._accumulate(self._get_accumulators(day), cells[in_day], values[in_day])
+
+    def _accumulate(self, accumulators, cells, values):
+        cell_count = self._rows * self._cols
+        accumulators['count'] += np.bincount(cells, minlength=cell_count)
+        accumulators['sum'] += np.bincount(cells, weights=values, minlength=cell_count)
+        accumulators['sum_squares'] += np.bincount(cells, weights=values * values, minlength=cell_count)
+        # min and max are reduced over runs of equal cells after sorting
+        order = np.argsort(cells, kind='stable')
+        sorted_cells, sorted_values = cells[order], values[order]
+        unique_cells, starts = np.unique(sorted_cells, return_index=True)
+        np.minimum.at(accumulators['min'], unique_cells, np.minimum.reduceat(sorted_values, starts))
+        np.maximum.at(accumulators['max'], unique_cells, np.maximum.reduceat(sorted_values, starts))
+
+    def to_dataset(self):
+        import xarray as xr
+        days = sorted(self._days.keys())
+        shape = (len(days), self._rows, self._cols)
+        stacked = dict([
+            (name, np.stack([self._days[day][name] for day in days]).reshape(shape) if len(days) > 0 else np.zeros(shape))
+            for name in ('count', 'sum', 'sum_squares', 'min', 'max')
+        ])
+        count = stacked['count']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, stacked['sum'] / count, np.nan)
+            variance = np.where(count > 0, np.maximum(stacked['sum_squares'] / count - mean * mean, 0), np.nan)
+        dims = ('time', 'latitude', 'longitude')
+        name = self._variable_name
+        return xr.Dataset(
+            {
+                f'{name}_sum': (dims, stacked['sum']),
+                f'{name}_sum_squares': (dims, stacked['sum_squares']),
+                f'{name}_mean': (dims, mean.astype(np.float32)),
+                f'{name}_variance': (dims, variance.astype(np.float32)),
+                f'{name}_min': (dims, np.where(count > 0, stacked['min'], np.nan).astype(np.float32)),
+                f'{name}_max': (dims, np.where(count > 0, stacked['max'], np.nan).astype(np.float32)),
+                f'{name}_count': (dims, count.astype(np.int32))
+            },
+            coords={
+                'time': np.array(days, dtype='datetime64[ns]'),
+                'latitude': self._latitude_range[0] + (np.arange(self._rows) + 0.5) * self._resolution,
+                'longitude': self._longitude_range[0] + (np.arange(self._cols) + 0.5) * self._resolution
+            }
+        )
+
+    def _merge_existing(self):
+        import xarray as xr
+        name = self._variable_name
+        with xr.open_dataset(self._filename) as existing:
+            existing = existing.load()
+        for index, day in enumerate(existing['time'].values.astype('datetime64[D]')):
+            accumulators = self._get_accumulators(day)
+            count = existing[f'{name}_count'].values[index].ravel()
+            accumulators['count'] += count
+            accumulators['sum'] += existing[f'{name}_sum'].values[index].ravel()
+            accumulators['sum_squares'] += existing[f'{name}_sum_squares'].values[index].ravel()
+            accumulators['min'] = np.fmin(accumulators['min'], np.where(count > 0, existing[f'{name}_min'].values[index].ravel(), np.inf))
+            accumulators['max'] = np.fmax(accumulators['max'], np.where(count > 0, existing[f'{name}_max'].values[index].ravel(), -np.inf))
+
+    def close(self):
+        if self._filename is None or (len(self._days) == 0 and not os.path.isfile(self._filename)):
+            self._commit()
+            return
+        # running sums are stored next to the statistics, so incremental runs keep accumulating into the same grid
+        if os.path.isfile(self._filename):
+            self._merge_existing()
+        tmp_filename = self._filename + '.tmp'
+        self.to_dataset().to_netcdf(tmp_filename)
+        os.replace(tmp_filename, self._filename)
+        self._days = {}
+        self._commit()
@@ -0,0 +1,170 @@
+import json
+import numpy as np
+
+from core.metrics import metrics
+from extractors.sinks import OutputSink, create_sink, resolve_column
+
+EARTH_RADIUS_KM = 6371.0
+STATIONS_FILE = "./config/stations.json"
+
+def to_unit_vectors(latitudes, longitudes):
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack([cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)])
+
+def chord_to_km(chords):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chords / 2, 1.0))
+
+def km_to_chord(distances):
+    return 2 * np.sin(np.asarray(distances) / (2 * EARTH_RADIUS_KM))
+
+def load_stations(path=STATIONS_FILE, region=None):
+    with open(path) as stations_file:
+        stations = json.load(stations_file)
+    names = list(stations.keys())
+    latitudes = np.array([stations[name]['latitude'] for name in names], dtype=np.float64)
+    longitudes = np.array([stations[name]['longitude'] for name in names], dtype=np.float64)
+    if region is not None:
+        inside = region.contains(latitudes, longitudes)
+        names, latitudes, longitudes = [name for name, keep in zip(names, inside) if keep], latitudes[inside], longitudes[inside]
+    return names, latitudes, longitudes
+
+
+class StationCollocator(OutputSink):
+    # keeps the nearest pixels of every station and reading time instead of the raw pixels, one row per collocation
+    LATITUDE_COLUMN = 'Geodetic Latitude'
+    LONGITUDE_COLUMN = 'Geodetic Longitude'
+    TIME_COLUMN = 'TAI Time at Start of Scan'
+    RADIUS_KM = 25.0
+    MAX_PIXELS = 9
+    TIME_WINDOW = np.timedelta64(30, 'm')
+    TIME_STEP = np.timedelta64(1, 'h')
+
+    def __init__(self,
+                filename,
+                stations,
+                value_column,
+                radius_km=RADIUS_KM,
+                max_pixels=MAX_PIXELS,
+                time_window=TIME_WINDOW,
+                times=None,
+                time_step=TIME_STEP,
+                output_format='csv',
+                latitude_column=LATITUDE_COLUMN,
+                longitude_column=LONGITUDE_COLUMN,
+                time_column=TIME_COLUMN,
+                read_plan=None):
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            raise ImportError('StationCollocator requires scipy. Install it with: pip install scipy')
+        self._tree_class = cKDTree
+        self._filename = filename
+        self._station_names, station_latitudes, station_longitudes = stations
+        self._station_vectors = to_unit_vectors(station_latitudes, station_longitudes)
+        self._requested_columns = (value_column, latitude_column, longitude_column, time_column)
+        self._columns = None
+        self._read_plan = read_plan
+        self._radius_chord = km_to_chord(radius_km)
+        self._max_pixels = max_pixels
+        self._time_window = time_window.astype('timedelta64[ns]')
+        # reading times of the ground stations, a regular grid of time_step when they are not given
+        self._times = None if times is None else np.sort(np.asarray(times, dtype='datetime64[ns]'))
+        self._time_step = time_step.astype('timedelta64[ns]')
+        self._output_format = output_format
+        self._candidates = {}
+
+    def _get_reading_times(self, first_time, last_time):
+        start, end = first_time - self._time_window, last_time + self._time_window
+        if self._times is not None:
+            return self._times[np.searchsorted(self._times, start, side='left'):np.searchsorted(self._times, end, side='right')]
+        step = self._time_step.astype(np.int64)
+        first_step = -(-start.astype(np.int64) // step)
+        last_step = end.astype(np.int64) // step
+        return (np.arange(first_step, last_step + 1) * step).astype('datetime64[ns]')
+
+    def write(self, data):
+        data_length, json_data = data
+        if data_length == 0 or len(self._station_names) == 0:
+            return
+        if self._columns is None:
+            self._columns = [resolve_column(name, list(json_data.keys()), self._read_plan) for name in self._requested_columns]
+        value_column, latitude_column, longitude_column, time_column = self._columns
+        with metrics.timer('collocate'):
+            values = np.asarray(json_data[value_column], dtype=np.float64)
+            times = np.asarray(json_data[time_column]).astype('datetime64[ns]')
+            valid = ~np.isnan(values) & ~np.isnat(times)
+            # pixels are sorted by time once per granule, every reading time then takes a contiguous slice of them
+            order = np.flatnonzero(valid)[np.argsort(times[valid], kind='stable')]
+            if len(order) == 0:
+                return
+            times = times[order]
+            values = values[order]
+            vectors = to_unit_vectors(
+                np.asarray(json_data[latitude_column], dtype=np.float64)[order],
+                np.asarray(json_data[longitude_column], dtype=np.float64)[order]
+            )
+            trees = {}
+            for reading_time in self._get_reading_times(times[0], times[-1]):
+                start = np.searchsorted(times, reading_time - self._time_window, side='left')
+                stop = np.searchsorted(times, reading_time + self._time_window, side='right')
+                if start == stop:
+                    continue
+                # consecutive reading times usually cover the same pixels of a granule, which then share one tree
+                if (start, stop) not in trees:
+                    trees[(start, stop)] = self._query(vectors[start:stop])
+                distances, indices = trees[(start, stop)]
+                self._add_candidates(reading_time, distances, start + indices, values, times)
+
+    def _query(self, vectors):
+        tree = self._tree_class(vectors)
+        k = min(self._max_pixels, len(vectors))
+        # all stations are queried at once, neighbours beyond the radius come back with an infinite distance
+        distances, indices = tree.query(self._station_vectors, k=k, distance_upper_bound=self._radius_chord)
+        return distances.reshape(len(self._station_vectors), k), indices.reshape(len(self._station_vectors), k)
+
+    def _add_candidates(self, reading_time, distances, indices, values, times):
+        found = np.isfinite(distances)
+        for station_index in np.flatnonzero(found.any(axis=1)):
+            station_found = found[station_index]
+            pixel_indices = indices[station_index][station_found]
+            candidates = self._candidates.setdefault((self._station_names[station_index], reading_time), [])
+            candidates.append((
+                chord_to_km(distances[station_index][station_found]),
+                values[pixel_indices],
+                (times[pixel_indices] - reading_time) / np.timedelta64(1, 'm')
+            ))
+
+    def to_table(self):
+        # a station can be covered by several granules around a reading time, the nearest pixels of all of them are kept
+        keys = sorted(self._candidates.keys(), key=lambda key: (key[1], key[0]))
+        columns = dict([(name, []) for name in (
+            'Station', 'Time (UTC+0)', 'Pixels', 'Mean', 'Standard deviation', 'Nearest value',
+            'Nearest distance (km)', 'Mean distance (km)', 'Mean time offset (minutes)'
+        )])
+        for station, reading_time in keys:
+            distances, values, offsets = [np.concatenate(arrays) for arrays in zip(*self._candidates[(station, reading_time)])]
+            nearest = np.argsort(distances, kind='stable')[:self._max_pixels]
+            distances, values, offsets = distances[nearest], values[nearest], offsets[nearest]
+            for name, value in (
+                ('Station', station),
+                ('Time (UTC+0)', reading_time),
+                ('Pixels', len(values)),
+                ('Mean', values.mean()),
+                ('Standard deviation', values.std()),
+                ('Nearest value', values[0]),
+                ('Nearest distance (km)', distances[0]),
+                ('Mean distance (km)', distances.mean()),
+                ('Mean time offset (minutes)', offsets.mean())
+            ):
+                columns[name].append(value)
+        dtypes = {'Station': str, 'Time (UTC+0)': 'datetime64[s]', 'Pixels': np.int32}
+        return len(keys), dict([(name, np.array(values, dtype=dtypes.get(name, np.float32))) for name, values in columns.items()])
+
+    def close(self):
+        if len(self._candidates) > 0:
+            with create_sink(self._output_format, self._filename) as sink:
+                sink.write(self.to_table())
+            self._candidates = {}
+        self._commit()
@@ -0,0 +1,145 @@
+import numpy as np
+
+class Categorical:
+    # codes into a small table of labels, the labels are only materialized when a sink needs them as text
+    def __init__(self, codes, categories, category_values):
+        self.codes = codes
+        self.categories = categories
+        # the original flag value of every category, for sinks storing numbers instead of labels
+        self.category_values = category_values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return Categorical(self.codes[index], self.categories, self.category_values)
+
+    def __array__(self, dtype=None, copy=None):
+        labels = self.categories[self.codes]
+        return labels if dtype is None else labels.astype(dtype)
+
+
+class ColumnSpec:
+
+    def __init__(self,
+                sds_name,
+                column_name=None,
+                units=None,
+                solutions=None,
+                dtype=None,
+                decode=False,
+                mask_fill=False,
+                categories=None,
+                epoch=None,
+                transform=None):
+        self.sds_name = sds_name
+        # column_name and units default to the long_name and units attributes of the SDS
+        self.column_name = column_name
+        self.units = units
+        self.solutions = solutions
+        self.dtype = dtype
+        self.decode = decode
+        self.mask_fill = mask_fill
+        self.categories = categories
+        self.epoch = epoch
+        self.transform = transform
+
+
+class CompiledColumn:
+
+    def __init__(self, spec):
+        if spec.mask_fill and spec.epoch is None and (spec.dtype is None or not np.issubdtype(spec.dtype, np.floating)):
+            raise ValueError(f'Column {spec.sds_name} masks fill values, which needs a floating point dtype')
+        if spec.categories is not None and (spec.decode or spec.epoch is not None):
+            raise ValueError(f'Categorical column {spec.sds_name} can not be decoded')
+        self.sds_name = spec.sds_name
+        self._spec = spec
+        self.solution_indices = None if spec.solutions is None else np.array(list(spec.solutions.keys()))
+        self._solution_names = None if spec.solutions is None else list(spec.solutions.values())
+        if spec.categories is not None:
+            self._category_values = np.array(sorted(spec.categories.keys()))
+            self._category_labels = np.array([f'{value} ({spec.categories[value]})' for value in self._category_values.tolist()])
+
+    @property
+    def column_count(self):
+        return 1 if self._solution_names is None else len(self._solution_names)
+
+    def get_names(self, attributes):
+        column_name = self._spec.column_name if self._spec.column_name is not None else attributes['long_name']
+        units = self._spec.units if self._spec.units is not None else attributes['units']
+        if self._solution_names is None:
+            return [f'{column_name} ({units})']
+        return [f'{column_name} ({solution_name}, {units})' for solution_name in self._solution_names]
+
+    def gather(self, data_values, rows, cols):
+        # always returns one row of values per output column
+        if self.solution_indices is None:
+            return data_values[rows, cols][None]
+        return data_values[self.solution_indices[:, None], rows, cols]
+
+    def decode(self, values, attributes):
+        spec = self._spec
+        if spec.categories is not None:
+            return self._to_categorical(values)
+        invalid = self._get_invalid(values, attributes) if spec.mask_fill else None
+        if spec.decode:
+            values = self._scale(values, attributes)
+        if spec.dtype is not None:
+            values = values.astype(spec.dtype, copy=False)
+        if spec.epoch is not None:
+            values = spec.epoch + values.astype(np.int64).astype('timedelta64[s]')
+        if invalid is not None:
+            # values were gathered from the window, so they can be masked in place
+            values[invalid] = np.datetime64('NaT') if spec.epoch is not None else np.nan
+        if spec.transform is not None:
+            values = spec.transform(values)
+        return values
+
+    @staticmethod
+    def _scale(values, attributes):
+        # MODIS stores physical = scale_factor * (raw - add_offset), unlike the CF convention raw * scale + offset.
+        # Scaling in float64 and casting once gives the float32 closest to the physical value, 0.001 * 2902 -> 2.902
+        scale_factor = float(attributes.get('scale_factor', 1.0))
+        add_offset = float(attributes.get('add_offset', 0.0))
+        return scale_factor * (values.astype(np.float64) - add_offset)
+
+    @staticmethod
+    def _get_invalid(values, attributes):
+        invalid = np.zeros(values.shape, dtype=bool)
+        if '_FillValue' in attributes:
+            invalid |= values == attributes['_FillValue']
+        if 'valid_range' in attributes:
+            valid_min, valid_max = attributes['valid_range']
+            invalid |= (values < valid_min) | (values > valid_max)
+        return invalid
+
+    def _to_categorical(self, values):
+        codes = np.searchsorted(self._category_values, values)
+        known = (codes < len(self._category_values)) & (self._category_values[np.minimum(codes, len(self._category_values) - 1)] == values)
+        if not known.all():
+            unknown = np.unique(values[~known]).tolist()
+            raise KeyError(f'Column {self.sds_name} has values without a category: {unknown}')
+        return Categorical(codes.astype(np.min_scalar_type(len(self._category_values))), self._category_labels, self._category_values)
+
+
+class ReadPlan:
+
+    def __init__(self, specs):
+        self.columns = [CompiledColumn(spec) for spec in specs]
+
+    @property
+    def sds_names(self):
+        return [column.sds_name for column in self.columns]
+
+    def get_column_names(self, sds_name, columns):
+        # output columns follow the order of the plan, one per solution of every SDS, so the names of an SDS
+        # are found without its long_name even when the granule was read in another process
+        columns = list(columns)
+        if len(columns) != sum([column.column_count for column in self.columns]):
+            raise ValueError(f'Columns {", ".join(columns)} were not extracted with this read plan')
+        start = 0
+        for column in self.columns:
+            if column.sds_name == sds_name:
+                return columns[start:start + column.column_count]
+            start += column.column_count
+        raise KeyError(f'SDS {sds_name} is not read by this plan. Available SDS: {", ".join(self.sds_names)}')
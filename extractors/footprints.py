@@ -0,0 +1,72 @@
+import json
+import os
+import re
+from pyhdf.SD import SD, SDC
+
+METADATA_ATTRIBUTES = ('ArchiveMetadata.0', 'CoreMetadata.0')
+BOUNDING_COORDINATES = ('NORTHBOUNDINGCOORDINATE', 'SOUTHBOUNDINGCOORDINATE', 'EASTBOUNDINGCOORDINATE', 'WESTBOUNDINGCOORDINATE')
+
+def read_footprint(dataset):
+    attributes = dataset.attributes()
+    metadata = "\n".join([str(attributes[name]) for name in METADATA_ATTRIBUTES if name in attributes])
+    footprint = []
+    for coordinate in BOUNDING_COORDINATES:
+        match = re.search(r'OBJECT\s*=\s*' + coordinate + r'\b.*?VALUE\s*=\s*\(?\s*([-+.\deE]+)', metadata, re.S)
+        if match is None:
+            return None
+        footprint.append(float(match.group(1)))
+    return tuple(footprint)
+
+def read_hdf_footprint(full_path):
+    dataset = SD(full_path, SDC.READ)
+    try:
+        return read_footprint(dataset)
+    finally:
+        dataset.end()
+
+def read_netcdf_footprint(full_path):
+    from netCDF4 import Dataset
+    with Dataset(full_path) as dataset:
+        attributes = dict([(name, dataset.getncattr(name)) for name in dataset.ncattrs()])
+    names = ('geospatial_lat_max', 'geospatial_lat_min', 'geospatial_lon_max', 'geospatial_lon_min')
+    if not all([name in attributes for name in names]):
+        return None
+    return tuple([float(attributes[name]) for name in names])
+
+def intersects(footprint, latitude_range, longitude_range):
+    if footprint is None:
+        return True
+    north, south, east, west = footprint
+    min_latitude, max_latitude = latitude_range
+    min_longitude, max_longitude = longitude_range
+    if south > max_latitude or north < min_latitude:
+        return False
+    if west <= east:
+        return west <= max_longitude and east >= min_longitude
+    # granule crosses the antimeridian
+    return max_longitude >= west or min_longitude <= east
+
+
+class FootprintCache:
+
+    def __init__(self, cache_path=None):
+        self._cache_path = cache_path
+        self._footprints = {}
+        if cache_path is not None and os.path.isfile(cache_path):
+            with open(cache_path) as cache_file:
+                self._footprints = json.load(cache_file)
+
+    def get(self, full_path, reader=read_hdf_footprint):
+        key = os.path.basename(full_path)
+        if key not in self._footprints:
+            self._footprints[key] = reader(full_path)
+        return self._footprints[key]
+
+    def filter(self, full_paths, latitude_range, longitude_range, reader=read_hdf_footprint):
+        return [full_path for full_path in full_paths if intersects(self.get(full_path, reader), latitude_range, longitude_range)]
+
+    def save(self):
+        if self._cache_path is None:
+            return
+        with open(self._cache_path, 'w') as cache_file:
+            json.dump(self._footprints, cache_file)
@@ -0,0 +1,41 @@
+from extractors import BaseSentinel5PExtractor
+from extractors.columns import ColumnSpec, ReadPlan
+
+import numpy as np
+
+class OzoneS5PExtractor(BaseSentinel5PExtractor):
+    MIN_QA_VALUE = 0.5
+
+    def __init__(self):
+        self._read_plan = ReadPlan(OzoneS5PExtractor.get_extractor_config())
+
+    def _process_file(self, dataset, latitude_range, longitude_range, region=None):
+        return super()._get_json_data(
+            dataset=dataset,
+            read_plan=self._read_plan,
+            latitude_range=latitude_range,
+            longitude_range=longitude_range,
+            qa_flag_name='qa_value',
+            min_qa_flag=OzoneS5PExtractor.MIN_QA_VALUE,
+            region=region
+        )
+
+    def _process_file_by_region(self, dataset, region_index):
+        return super()._get_json_data_by_region(
+            dataset=dataset,
+            read_plan=self._read_plan,
+            region_index=region_index,
+            qa_flag_name='qa_value',
+            min_qa_flag=OzoneS5PExtractor.MIN_QA_VALUE
+        )
+
+    @staticmethod
+    def get_extractor_config():
+        return [
+            ColumnSpec('time_utc', column_name='Time', units='Time UTC+0', transform=BaseSentinel5PExtractor.parse_utc_times),
+            ColumnSpec('latitude', dtype=np.float32),
+            ColumnSpec('longitude', dtype=np.float32),
+            ColumnSpec('ozone_total_vertical_column', dtype=np.float32),
+            ColumnSpec('ozone_total_vertical_column_precision', dtype=np.float32),
+            ColumnSpec('qa_value', dtype=np.float32)
+        ]
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+import json
+import numpy as np
+
+REGIONS_FILE = "./config/regions.json"
+
+def _get_rings(geojson):
+    if geojson['type'] == 'FeatureCollection':
+        return [ring for feature in geojson['features'] for ring in _get_rings(feature)]
+    if geojson['type'] == 'Feature':
+        return _get_rings(geojson['geometry'])
+    if geojson['type'] == 'Polygon':
+        return [np.asarray(ring, dtype=float) for ring in geojson['coordinates']]
+    if geojson['type'] == 'MultiPolygon':
+        return [np.asarray(ring, dtype=float) for polygon in geojson['coordinates'] for ring in polygon]
+    raise ValueError(f'Unsupported geometry type: {geojson["type"]}')
+
+def points_in_rings(longitudes, latitudes, rings):
+    # even-odd ray casting, vectorized over points and looped over edges, holes are handled by the even-odd rule
+    inside = np.zeros(np.shape(longitudes), dtype=bool)
+    for ring in rings:
+        ring = ring if np.array_equal(ring[0], ring[-1]) else np.vstack([ring, ring[:1]])
+        for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+            crosses = (y1 > latitudes) != (y2 > latitudes)
+            if not crosses.any():
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = (x2 - x1) * (latitudes - y1) / (y2 - y1) + x1
+            inside ^= crosses & (longitudes < x_cross)
+    return inside
+
+def segments_intersect_boxes(starts, ends, boxes):
+    # Liang-Barsky clipping of every segment against every box, segments (E, 2) and boxes (T, 4) as lon_min, lon_max, lat_min, lat_max
+    x0, y0 = starts[:, 0, None], starts[:, 1, None]
+    dx, dy = (ends[:, 0] - starts[:, 0])[:, None], (ends[:, 1] - starts[:, 1])[:, None]
+    lon_min, lon_max, lat_min, lat_max = boxes[None, :, 0], boxes[None, :, 1], boxes[None, :, 2], boxes[None, :, 3]
+    t_start = np.zeros((len(starts), len(boxes)))
+    t_end = np.ones((len(starts), len(boxes)))
+    outside = np.zeros((len(starts), len(boxes)), dtype=bool)
+    for p, q in ((-dx, x0 - lon_min), (dx, lon_max - x0), (-dy, y0 - lat_min), (dy, lat_max - y0)):
+        p, q = np.broadcast_arrays(p, q)
+        parallel = p == 0
+        outside |= parallel & (q < 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = q / p
+        t_start = np.where(~parallel & (p < 0), np.maximum(t_start, r), t_start)
+        t_end = np.where(~parallel & (p > 0), np.minimum(t_end, r), t_end)
+    return (~outside & (t_start <= t_end)).any(axis=0)
+
+
+class Region:
+    RASTER_RESOLUTION = 0.01
+    MAX_RASTER_SIZE = 1024
+    OUTSIDE, INSIDE, BOUNDARY = 0, 1, 2
+
+    def __init__(self, name, geojson, resolution=RASTER_RESOLUTION):
+        self.name = name
+        self.rings = _get_rings(geojson)
+        points = np.vstack(self.rings)
+        self.latitude_range = (float(points[:, 1].min()), float(points[:, 1].max()))
+        self.longitude_range = (float(points[:, 0].min()), float(points[:, 0].max()))
+        self._resolution = resolution
+        self._raster = None
+
+    def _get_raster(self):
+        if self._raster is not None:
+            return self._raster
+        (min_latitude, max_latitude), (min_longitude, max_longitude) = self.latitude_range, self.longitude_range
+        rows = int(min(max(np.ceil((max_latitude - min_latitude) / self._resolution), 1), Region.MAX_RASTER_SIZE))
+        cols = int(min(max(np.ceil((max_longitude - min_longitude) / self._resolution), 1), Region.MAX_RASTER_SIZE))
+        cell_height = (max_latitude - min_latitude) / rows
+        cell_width = (max_longitude - min_longitude) / cols
+        corner_latitudes = min_latitude + np.arange(rows + 1)[:, None] * cell_height
+        corner_longitudes = min_longitude + np.arange(cols + 1)[None, :] * cell_width
+        corners = points_in_rings(
+            np.broadcast_to(corner_longitudes, (rows + 1, cols + 1)), 
+            np.broadcast_to(corner_latitudes, (rows + 1, cols + 1)), 
+            self.rings
+        ).astype(np.int8)
+        inside_corners = corners[:-1, :-1] + corners[1:, :-1] + corners[:-1, 1:] + corners[1:, 1:]
+        raster = np.full((rows, cols), Region.BOUNDARY, dtype=np.int8)
+        raster[inside_corners == 0] = Region.OUTSIDE
+        raster[inside_corners == 4] = Region.INSIDE
+        # an edge can cross a cell without flipping any of its corners, e.g. a hole or an inlet thinner than a cell,
+        # so every cell an edge passes through is a boundary cell and only the others are classified by their corners
+        for ring in self.rings:
+            ring = ring if np.array_equal(ring[0], ring[-1]) else np.vstack([ring, ring[:1]])
+            edge_rows, edge_cols = self._get_cells(ring[:, 1], ring[:, 0], (rows, cols, cell_height, cell_width))
+            raster[edge_rows, edge_cols] = Region.BOUNDARY
+            # edges within a single cell are covered by the cells of their vertices
+            spanning = np.flatnonzero((edge_rows[:-1] != edge_rows[1:]) | (edge_cols[:-1] != edge_cols[1:]))
+            for edge in spanning:
+                row_slice = slice(min(edge_rows[edge], edge_rows[edge + 1]), max(edge_rows[edge], edge_rows[edge + 1]) + 1)
+                col_slice = slice(min(edge_cols[edge], edge_cols[edge + 1]), max(edge_cols[edge], edge_cols[edge + 1]) + 1)
+                cell_rows, cell_cols = np.mgrid[row_slice, col_slice]
+                boxes = np.stack([
+                    min_longitude + cell_cols.ravel() * cell_width, min_longitude + (cell_cols.ravel() + 1) * cell_width,
+                    min_latitude + cell_rows.ravel() * cell_height, min_latitude + (cell_rows.ravel() + 1) * cell_height
+                ], axis=1)
+                crossed = segments_intersect_boxes(ring[edge:edge + 1], ring[edge + 1:edge + 2], boxes)
+                raster[cell_rows.ravel()[crossed], cell_cols.ravel()[crossed]] = Region.BOUNDARY
+        raster[[0, -1], :] = Region.BOUNDARY
+        raster[:, [0, -1]] = Region.BOUNDARY
+        self._raster = (raster, rows, cols, cell_height, cell_width)
+        return self._raster
+
+    def _get_cells(self, latitudes, longitudes, raster_shape):
+        rows, cols, cell_height, cell_width = raster_shape
+        cell_rows = np.clip(((latitudes - self.latitude_range[0]) / cell_height).astype(np.intp), 0, rows - 1)
+        cell_cols = np.clip(((longitudes - self.longitude_range[0]) / cell_width).astype(np.intp), 0, cols - 1)
+        return cell_rows, cell_cols
+
+    def contains(self, latitudes, longitudes):
+        latitudes = np.asarray(latitudes)
+        longitudes = np.asarray(longitudes)
+        min_latitude, max_latitude = self.latitude_range
+        min_longitude, max_longitude = self.longitude_range
+        in_box = (latitudes > min_latitude) & (latitudes < max_latitude) & (longitudes > min_longitude) & (longitudes < max_longitude)
+        candidates = np.flatnonzero(in_box)
+        candidate_latitudes = latitudes.ravel()[candidates]
+        candidate_longitudes = longitudes.ravel()[candidates]
+        raster, *raster_shape = self._get_raster()
+        cell_classes = raster[self._get_cells(candidate_latitudes, candidate_longitudes, raster_shape)]
+        result = np.zeros(latitudes.size, dtype=bool)
+        result[candidates[cell_classes == Region.INSIDE]] = True
+        boundary = cell_classes == Region.BOUNDARY
+        result[candidates[boundary]] = points_in_rings(candidate_longitudes[boundary], candidate_latitudes[boundary], self.rings)
+        return result.reshape(latitudes.shape)
+
+
+class RegionIndex:
+
+    def __init__(self, regions):
+        self._regions = list(regions)
+
+    def get(self, name):
+        return next(region for region in self._regions if region.name == name)
+
+    def subset(self, names):
+        return RegionIndex([region for region in self._regions if region.name in names])
+
+    @property
+    def names(self):
+        return [region.name for region in self._regions]
+
+    @property
+    def latitude_range(self):
+        return min([region.latitude_range[0] for region in self._regions]), max([region.latitude_range[1] for region in self._regions])
+
+    @property
+    def longitude_range(self):
+        return min([region.longitude_range[0] for region in self._regions]), max([region.longitude_range[1] for region in self._regions])
+
+    def get_box(self):
+        (min_latitude, max_latitude), (min_longitude, max_longitude) = self.latitude_range, self.longitude_range
+        return min_latitude, min_longitude, max_latitude, max_longitude
+
+    def assign(self, latitudes, longitudes):
+        latitudes = np.ravel(latitudes)
+        longitudes = np.ravel(longitudes)
+        # pixels are sorted by latitude once, so every region only tests the band of pixels inside its latitude range
+        order = np.argsort(latitudes, kind='stable')
+        sorted_latitudes = latitudes[order]
+        pixels_by_region = OrderedDict()
+        for region in self._regions:
+            min_latitude, max_latitude = region.latitude_range
+            start = np.searchsorted(sorted_latitudes, min_latitude, side='right')
+            stop = np.searchsorted(sorted_latitudes, max_latitude, side='left')
+            candidates = order[start:stop]
+            matches = region.contains(latitudes[candidates], longitudes[candidates])
+            pixels_by_region[region.name] = np.sort(candidates[matches])
+        return pixels_by_region
+
+
+def load_regions(path=REGIONS_FILE, names=None):
+    with open(path) as regions_file:
+        geojson_by_name = json.load(regions_file)
+    names = list(geojson_by_name.keys()) if names is None else names
+    missing = [name for name in names if name not in geojson_by_name]
+    if len(missing) > 0:
+        raise ValueError(f'Unknown regions: {", ".join(missing)}. Available regions: {", ".join(geojson_by_name.keys())}')
+    return RegionIndex([Region(name, geojson_by_name[name]) for name in names])
@@ -0,0 +1,247 @@
+import json
+import os
+import numpy as np
+
+from extractors.columns import Categorical
+
+def resolve_column(name, columns, read_plan=None):
+    # with the read plan of the extractor a column is requested by its SDS name, otherwise by its output name
+    # or the start of it, since output columns carry their units and solutions
+    if read_plan is not None and name in read_plan.sds_names:
+        names = read_plan.get_column_names(name, columns)
+        if len(names) > 1:
+            raise KeyError(f'SDS {name} has one column per solution, request one of: {", ".join(names)}')
+        return names[0]
+    if name in columns:
+        return name
+    matching = [column for column in columns if column.startswith(name)]
+    if len(matching) == 0:
+        raise KeyError(f'Column {name} not found. Available columns: {", ".join(columns)}')
+    if len(matching) > 1:
+        raise KeyError(f'Column {name} is ambiguous, it starts {len(matching)} columns: {", ".join(matching)}')
+    return matching[0]
+
+
+def after_commit(sinks, callback):
+    # runs callback once every sink has committed the rows written so far
+    sinks = list(sinks)
+    if len(sinks) == 0:
+        callback()
+        return
+    remaining = [len(sinks)]
+
+    def committed():
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            callback()
+
+    for sink in sinks:
+        sink.after_commit(committed)
+
+
+class OutputSink:
+    IMPL_MESSAGE = "OutputSink is an abstract class. This method should be implemented in class extending this class"
+    # a durable sink has its rows on disk when write returns, the others only commit them in close
+    durable = False
+    _commit_callbacks = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def write(self, data):
+        raise NotImplementedError(OutputSink.IMPL_MESSAGE)
+
+    def after_commit(self, callback):
+        # progress of a granule is only recorded once its rows can no longer be lost
+        if self.durable:
+            callback()
+        else:
+            self._commit_callbacks = (self._commit_callbacks or []) + [callback]
+
+    def _commit(self):
+        callbacks, self._commit_callbacks = self._commit_callbacks or [], None
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self._commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvSink(OutputSink):
+    # every write is flushed, so rows survive the process being killed
+    durable = True
+
+    def __init__(self, filename, separator=";"):
+        self._filename = filename
+        self._separator = separator
+        self._file = None
+
+    def _open(self, columns):
+        write_header = not os.path.isfile(self._filename)
+        self._file = open(self._filename, mode='a')
+        if write_header:
+            self._file.write(self._separator.join(columns) + "\n")
+
+    def write(self, data):
+        data_length, json_data = data
+        if data_length == 0:
+            return
+        if self._file is None:
+            self._open(json_data.keys())
+        # str conversion happens once per column instead of once per cell
+        columns = [np.asarray(values).astype(str) for values in json_data.values()]
+        rows = map(self._separator.join, zip(*columns))
+        self._file.write("\n".join(rows) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def merge(shard_files, filename):
+        # shards are appended in the given order, the header is written once
+        header = None
+        with open(filename, 'wb') as merged:
+            for shard_file in shard_files:
+                with open(shard_file, 'rb') as shard:
+                    shard_header = shard.readline()
+                    if header is None:
+                        header = shard_header
+                        merged.write(header)
+                    elif shard_header != header:
+                        raise ValueError(f'Shard {shard_file} has different columns than {shard_files[0]}')
+                    while True:
+                        chunk = shard.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        merged.write(chunk)
+
+
+class ParquetSink(OutputSink):
+
+    def __init__(self, filename, compression='snappy'):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('ParquetSink requires pyarrow. Install it with: pip install pyarrow')
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._filename = filename
+        self._compression = compression
+        self._writer = None
+        self._schema = None
+        self._tmp_filename = None
+
+    def _open(self, schema):
+        existing = None
+        if os.path.isfile(self._filename):
+            # parquet files cannot be appended to, so existing row groups are copied into a new file
+            existing = self._pq.ParquetFile(self._filename)
+            schema = existing.schema_arrow
+        # the footer is only written on close, so the output is replaced then and a killed run leaves it untouched
+        self._tmp_filename = self._filename + '.tmp'
+        self._schema = schema
+        self._writer = self._pq.ParquetWriter(self._tmp_filename, schema, compression=self._compression)
+        if existing is not None:
+            for row_group in range(existing.num_row_groups):
+                self._writer.write_table(existing.read_row_group(row_group))
+
+    def write(self, data):
+        data_length, json_data = data
+        if data_length == 0:
+            return
+        fields, arrays = zip(*[self._to_column(name, values) for name, values in json_data.items()])
+        table = self._pa.Table.from_arrays(list(arrays), schema=self._pa.schema(list(fields)))
+        if self._writer is None:
+            self._open(table.schema)
+        # every granule ends up in its own row group
+        self._writer.write_table(table.cast(self._schema), row_group_size=data_length)
+
+    def _to_column(self, name, values):
+        if isinstance(values, Categorical):
+            # flags are stored as dictionary columns over their integer values, the labels are kept in the field metadata
+            array = self._pa.DictionaryArray.from_arrays(self._pa.array(values.codes.astype(np.int32)), self._pa.array(values.category_values))
+            return self._pa.field(name, array.type, metadata={'labels': json.dumps(np.asarray(values.categories).tolist())}), array
+        array = self._pa.array(np.asarray(values))
+        return self._pa.field(name, array.type), array
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._tmp_filename is not None:
+            os.replace(self._tmp_filename, self._filename)
+            self._tmp_filename = None
+        self._commit()
+
+    @staticmethod
+    def merge(shard_files, filename):
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for shard_file in shard_files:
+                shard = pq.ParquetFile(shard_file)
+                if writer is None:
+                    writer = pq.ParquetWriter(filename, shard.schema_arrow)
+                # row groups are copied as they are, so every granule keeps its own row group
+                for row_group in range(shard.num_row_groups):
+                    writer.write_table(shard.read_row_group(row_group))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+class MultiSink(OutputSink):
+
+    def __init__(self, sinks):
+        self._sinks = list(sinks)
+
+    @property
+    def filename(self):
+        return ", ".join([sink.filename for sink in self._sinks])
+
+    @property
+    def durable(self):
+        return all([sink.durable for sink in self._sinks])
+
+    def write(self, data):
+        for sink in self._sinks:
+            sink.write(data)
+
+    def close(self):
+        for sink in self._sinks:
+            sink.close()
+        self._commit()
+
+
+SINKS = {
+    'csv': CsvSink,
+    'parquet': ParquetSink
+}
+
+def create_sink(output_format, filename, **kwargs):
+    if output_format not in SINKS:
+        raise ValueError(f'Unknown output format: {output_format}. Available formats: {", ".join(SINKS.keys())}')
+    return SINKS[output_format](filename, **kwargs)
+
+def merge_shards(output_format, shard_files, filename):
+    if output_format not in SINKS:
+        raise ValueError(f'Unknown output format: {output_format}. Available formats: {", ".join(SINKS.keys())}')
+    shard_files = [shard_file for shard_file in shard_files if os.path.isfile(shard_file)]
+    if len(shard_files) == 0:
+        return None
+    # merged into a temporary file first, so a failed merge never leaves a truncated output behind
+    tmp_filename = filename + '.tmp'
+    SINKS[output_format].merge(shard_files, tmp_filename)
+    os.replace(tmp_filename, filename)
+    return filename
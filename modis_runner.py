@@ -0,0 +1,156 @@
+from api.modis import Modis
+import argparse
+import functools
+import logging
+import os
+from datetime import date
+
+from core.metrics import metrics
+from core.watermarks import WatermarkStore
+from extractors.aggregation import GridAggregator
+from extractors.collocation import StationCollocator, load_stations
+from extractors.regions import load_regions
+from extractors.sinks import create_sink, MultiSink, SINKS
+
+REGION = 'Lisbon'
+OUTPUT_DIR = './data/PM2.5'
+
+def create_region_sink(output_format, out_dir, region, value_column, read_plan, grid_resolution=None, stations_path=None):
+    sinks = [create_sink(output_format, out_dir + "/result." + output_format)]
+    if grid_resolution is not None:
+        sinks.append(GridAggregator(
+            filename=out_dir + "/result_grid.nc",
+            value_column=value_column,
+            latitude_range=region.latitude_range,
+            longitude_range=region.longitude_range,
+            resolution=grid_resolution,
+            read_plan=read_plan
+        ))
+    if stations_path is not None:
+        sinks.append(StationCollocator(
+            filename=out_dir + "/result_stations." + output_format,
+            stations=load_stations(stations_path, region),
+            value_column=value_column,
+            output_format=output_format,
+            read_plan=read_plan
+        ))
+    return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
+
+def process_result(extractor, dirname, latitude_range, longitude_range, workers=1, sink=None, region=None, on_processed=None):
+    extractor.process_files(
+        dirname=dirname,
+        out_file=dirname + "/result.csv",
+        latitude_range=latitude_range,
+        longitude_range=longitude_range,
+        delete_after=True,
+        workers=workers,
+        sink=sink,
+        region=region,
+        on_processed=on_processed
+    )
+
+def process_granule(extractor, full_path, latitude_range, longitude_range, sink=None, region=None, on_processed=None):
+    extractor.process_file(
+        full_path=full_path,
+        out_file=os.path.dirname(full_path) + "/result.csv",
+        latitude_range=latitude_range,
+        longitude_range=longitude_range,
+        sink=sink,
+        region=region,
+        on_processed=on_processed
+    )
+
+def process_result_by_region(extractor, dirname, latitude_range, longitude_range, region_index=None, workers=1, sinks=None, routes=None, on_processed=None):
+    extractor.process_files_by_region(
+        dirname=dirname,
+        region_index=region_index,
+        sinks=sinks,
+        delete_after=True,
+        workers=workers,
+        routes=routes,
+        on_processed=on_processed
+    )
+
+def process_granule_by_region(extractor, full_path, latitude_range, longitude_range, region_index=None, sinks=None, routes=None, on_processed=None):
+    extractor.process_file_by_region(
+        full_path=full_path,
+        region_index=region_index,
+        sinks=sinks,
+        routes=routes,
+        on_processed=on_processed
+    )
+
+
+def main(product, extractor, value_column):
+    # shared command line of the MODIS scripts, every product only differs in its extractor and the SDS it aggregates
+    parser = argparse.ArgumentParser(description=f'Download and extract {product} granules')
+    parser.add_argument('--pipelined', action='store_true', help='process each granule as soon as it is downloaded')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes extracting granules in parallel')
+    parser.add_argument('--format', choices=SINKS.keys(), default='csv', help='output format of the extracted data')
+    parser.add_argument('--incremental', action='store_true', help='only process granules newer than the last run')
+    parser.add_argument('--date-to', default=None, help='last day to process (YYYY-MM-DD), defaults to today in incremental mode')
+    parser.add_argument('--regions', default=None, help='comma separated regions from config/regions.json extracted from a single read of every granule')
+    parser.add_argument('--grid', type=float, default=None, help='also aggregate daily statistics on a lat/lon grid with this resolution in degrees')
+    parser.add_argument('--stations', default=None, help='collocate the AOD of every region with the ground stations of this file, e.g. config/stations.json')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help='verbosity of the progress output')
+    parser.add_argument('--metrics', default=None, help='write a JSON summary of stage timings and counters to this file')
+    parser.add_argument('--profile', default=None, help='write a cProfile dump of every extracted granule into this directory')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    metrics.profile_dir = args.profile
+
+    date_to = args.date_to
+    if args.incremental and date_to is None:
+        date_to = date.today().strftime('%Y-%m-%d')
+
+    api = Modis(config_name=f'ModisAPI-{product}')
+    if args.regions is None:
+        download_path = os.path.abspath(os.path.join(OUTPUT_DIR, REGION, product))
+        region = load_regions(names=[REGION]).get(REGION)
+        sink = create_region_sink(args.format, download_path, region, value_column, extractor.read_plan, args.grid, args.stations)
+        sinks = {REGION: sink}
+        region_name, box, router = REGION, None, None
+        process_func = functools.partial(process_result, extractor, workers=args.workers, sink=sink, region=region)
+        process_file_func = functools.partial(process_granule, extractor, sink=sink, region=region)
+    else:
+        region_index = load_regions(names=args.regions.split(','))
+        download_path = os.path.abspath(os.path.join(OUTPUT_DIR, product))
+        sinks = {}
+        for name in region_index.names:
+            out_dir = os.path.abspath(os.path.join(OUTPUT_DIR, name, product))
+            os.makedirs(out_dir, exist_ok=True)
+            sinks[name] = create_region_sink(args.format, out_dir, region_index.get(name), value_column, extractor.read_plan, args.grid, args.stations)
+        region_name, box = '+'.join(region_index.names), region_index.get_box()
+        # every MODIS tile is searched once for all regions, and granules are only matched against the regions of their tiles
+        router = api.create_router(region_index)
+        process_func = functools.partial(process_result_by_region, extractor, region_index=region_index, workers=args.workers, sinks=sinks, routes=router.routes)
+        process_file_func = functools.partial(process_granule_by_region, extractor, region_index=region_index, sinks=sinks, routes=router.routes)
+    watermarks = WatermarkStore(download_path + "/state.json") if args.incremental else None
+
+    try:
+        if args.pipelined:
+            api.download_and_process_pipelined(
+                download_path=download_path,
+                process_file_func=process_file_func,
+                box=box,
+                date_to=date_to,
+                watermarks=watermarks,
+                region_name=region_name,
+                router=router
+            )
+        else:
+            api.download_and_process(
+                download_path=download_path,
+                process_func=process_func,
+                box=box,
+                date_to=date_to,
+                watermarks=watermarks,
+                region_name=region_name,
+                router=router
+            )
+    finally:
+        for sink in sinks.values():
+            sink.close()
+        if args.metrics is not None:
+            metrics.write_summary(args.metrics)
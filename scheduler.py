@@ -0,0 +1,164 @@
+from api.config import load_config
+from api.modis import Modis
+import argparse
+import functools
+import logging
+import multiprocessing
+import os
+import shutil
+
+from core.scheduler import TaskStore, run_worker, get_worker_id
+from extractors.regions import load_regions
+from extractors.sinks import create_sink, merge_shards, SINKS
+from extractors.aerosol_mod04_3k_extractor import AerosolM0D043KExtractor
+from extractors.aerosol_mod04_l2_extrator import AerosolMOD04L2Extractor
+
+STORE_PATH = './data/scheduler.sqlite'
+OUTPUT_DIR = './data/PM2.5'
+PRODUCTS = {
+    'MOD04_L2': ('ModisAPI-MOD04_L2', AerosolMOD04L2Extractor),
+    'MOD04_3K': ('ModisAPI-MOD04_3K', AerosolM0D043KExtractor)
+}
+
+logger = logging.getLogger('scheduler')
+
+def get_task_dir(output_dir, region_name, product):
+    return os.path.join(output_dir, region_name, product)
+
+def get_download_path(task_dir, month, attempt):
+    return os.path.join(task_dir, 'downloads', f'{month}.{attempt}')
+
+def run_task(task, lost, output_format, output_dir):
+    config_name, extractor_class = PRODUCTS[task['product']]
+    region_index = load_regions(names=[task['region']])
+    region = region_index.get(task['region'])
+    month = task['date_from'][:7]
+    task_dir = get_task_dir(output_dir, task['region'], task['product'])
+    # every attempt downloads into its own directory, a worker that lost its lease may still be running next to the new
+    # owner until it notices, and must not share partial downloads or delete the granules of the new owner
+    download_path = get_download_path(task_dir, month, task['attempts'])
+    os.makedirs(download_path, exist_ok=True)
+    # every attempt writes its own shard, a worker that lost its lease never writes into the shard of the new owner
+    shard_dir = os.path.join(task_dir, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+    shard = os.path.join(shard_dir, f'{month}.{task["attempts"]}.{output_format}')
+    if os.path.isfile(shard):
+        os.remove(shard)
+    extractor = extractor_class()
+    sink = create_sink(output_format, shard)
+
+    def process_result(dirname, latitude_range, longitude_range, on_processed=None):
+        extractor.process_files(
+            dirname=dirname,
+            out_file=shard,
+            latitude_range=latitude_range,
+            longitude_range=longitude_range,
+            delete_after=True,
+            sink=sink,
+            region=region,
+            on_processed=on_processed
+        )
+
+    try:
+        Modis(config_name=config_name).download_and_process(
+            download_path=download_path,
+            process_func=process_result,
+            box=region_index.get_box(),
+            date_from=task['date_from'],
+            date_to=task['date_to'],
+            region_name=task['region'],
+            # granules extracted into the shard of a failed attempt are extracted again into the new shard
+            output_name=shard,
+            # set by the heartbeat once the task was reclaimed, the downloads stop and nothing more is extracted
+            cancelled=lost
+        )
+    finally:
+        sink.close()
+    # granules left behind by earlier attempts are not needed anymore
+    for attempt in range(1, task['attempts']):
+        shutil.rmtree(get_download_path(task_dir, month, attempt), ignore_errors=True)
+    return shard
+
+def work(store_path, lease_seconds, max_attempts, output_format, output_dir, log_level, worker=None):
+    logging.basicConfig(level=log_level, format='%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+    store = TaskStore(store_path, lease_seconds, max_attempts)
+    try:
+        completed = run_worker(store, functools.partial(run_task, output_format=output_format, output_dir=output_dir), worker)
+        logger.info(f'{worker or get_worker_id()} completed {completed} tasks')
+    finally:
+        store.close()
+
+def plan(store, products, region_names, date_from, date_to):
+    load_regions(names=region_names)
+    for product in products:
+        config_name, _ = PRODUCTS[product]
+        defaults = load_config(Modis.CONFIG_PATH, config_name)['defaults']['time']
+        start = date_from if date_from is not None else defaults['start']
+        end = date_to if date_to is not None else defaults['end']
+        for region_name in region_names:
+            added = store.add_tasks(product, region_name, start, end)
+            logger.info(f'Planned {added} new tasks for {product} over {region_name} from {start} to {end}')
+
+def merge(store, output_format, output_dir):
+    tasks_by_output = {}
+    for task in store.get_tasks():
+        tasks_by_output.setdefault((task['product'], task['region']), []).append(task)
+    for (product, region_name), tasks in tasks_by_output.items():
+        unfinished = [task['task_id'] for task in tasks if task['status'] != TaskStore.DONE]
+        if len(unfinished) > 0:
+            logger.warning(f'Not merging {product} over {region_name}, {len(unfinished)} tasks are not done: {", ".join(unfinished)}')
+            continue
+        # tasks are listed by month, so the merged output keeps the acquisition order of a single process run
+        filename = os.path.join(get_task_dir(output_dir, region_name, product), f'result.{output_format}')
+        merged = merge_shards(output_format, [task['output'] for task in tasks], filename)
+        logger.info(f'Merged {len(tasks)} shards of {product} over {region_name} into {merged}')
+
+def print_status(store):
+    counts = store.get_counts()
+    print(", ".join([f'{status}: {count}' for status, count in counts.items()]) or 'No tasks planned')
+    for task in store.get_tasks(status=TaskStore.FAILED):
+        print(f'{task["task_id"]} failed after {task["attempts"]} attempts: {task["error"]}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Spread (product, region, month) tasks over several worker processes or nodes')
+    parser.add_argument('command', choices=['plan', 'work', 'status', 'merge', 'retry'], help='plan tasks, run a worker, show progress, merge the shards or retry failed tasks')
+    parser.add_argument('--store', default=STORE_PATH, help='SQLite task store, on a filesystem shared by all nodes')
+    parser.add_argument('--products', default=','.join(PRODUCTS.keys()), help='comma separated products to plan')
+    parser.add_argument('--regions', default=None, help='comma separated regions from config/regions.json to plan, defaults to all of them')
+    parser.add_argument('--date-from', default=None, help='first day to plan (YYYY-MM-DD), defaults to the product config')
+    parser.add_argument('--date-to', default=None, help='last day to plan (YYYY-MM-DD), defaults to the product config')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes started by this node')
+    parser.add_argument('--lease', type=float, default=TaskStore.DEFAULT_LEASE_SECONDS, help='seconds without heartbeat after which a task is claimed again')
+    parser.add_argument('--max-attempts', type=int, default=TaskStore.DEFAULT_MAX_ATTEMPTS, help='attempts of a task before it is marked as failed')
+    parser.add_argument('--format', choices=SINKS.keys(), default='csv', help='output format of the shards and the merged output')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='directory holding the downloads, shards and merged output of every region')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help='verbosity of the progress output')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+    output_dir = os.path.abspath(args.output_dir)
+
+    if args.command == 'work':
+        worker_args = (args.store, args.lease, args.max_attempts, args.format, output_dir, args.log_level)
+        if args.processes <= 1:
+            work(*worker_args)
+        else:
+            workers = [multiprocessing.Process(target=work, args=worker_args) for _ in range(args.processes)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+    else:
+        store = TaskStore(args.store, args.lease, args.max_attempts)
+        try:
+            if args.command == 'plan':
+                region_names = None if args.regions is None else args.regions.split(',')
+                plan(store, args.products.split(','), region_names or load_regions().names, args.date_from, args.date_to)
+            elif args.command == 'merge':
+                merge(store, args.format, output_dir)
+            elif args.command == 'retry':
+                logger.info(f'{store.reset_failed()} failed tasks are pending again')
+            print_status(store)
+        finally:
+            store.close()
@@ -0,0 +1,55 @@
+from api.sentinel import Sentinel5P
+import argparse
+import functools
+import logging
+import os
+
+from core.metrics import metrics
+from extractors.regions import load_regions
+from extractors.sinks import create_sink, SINKS
+from extractors.ozone_s5p_extractor import OzoneS5PExtractor
+
+REGION = 'Lisbon'
+
+ex = OzoneS5PExtractor()
+
+def process_result(dirname, latitude_range, longitude_range, workers=1, sink=None, region=None):
+    ex.process_files(
+        dirname=dirname,
+        out_file=dirname + "/result.csv",
+        latitude_range=latitude_range,
+        longitude_range=longitude_range,
+        delete_after=True,
+        workers=workers,
+        sink=sink,
+        region=region
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help='number of processes extracting products in parallel')
+    parser.add_argument('--format', choices=SINKS.keys(), default='csv', help='output format of the extracted data')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help='verbosity of the progress output')
+    parser.add_argument('--metrics', default=None, help='write a JSON summary of stage timings and counters to this file')
+    parser.add_argument('--profile', default=None, help='write a cProfile dump of every extracted granule into this directory')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    metrics.profile_dir = args.profile
+
+    download_path = os.path.abspath('./data/O3/Lisbon/L2__O3____')
+    region = load_regions(names=[REGION]).get(REGION)
+    sink = create_sink(args.format, download_path + "/result." + args.format)
+    process_func = functools.partial(process_result, workers=args.workers, sink=sink, region=region)
+
+    api = Sentinel5P(config_name="SentinelAPI-L2__O3")
+    try:
+        api.download_and_process(
+            download_path=download_path,
+            process_func=process_func
+        )
+    finally:
+        sink.close()
+        if args.metrics is not None:
+            metrics.write_summary(args.metrics)
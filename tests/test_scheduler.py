@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import threading
+import time
+
+from core.scheduler import TaskStore, run_worker, get_worker_id
+
+LEASE_SECONDS = 0.5
+MAX_ATTEMPTS = 2
+
+def claim_and_die(path):
+    # a killed worker neither completes nor fails its task, it only stops sending heartbeats
+    store = TaskStore(path, LEASE_SECONDS, MAX_ATTEMPTS)
+    store.claim(get_worker_id())
+    os._exit(1)
+
+def wait_for_other_workers(store, worker, timeout=5):
+    # a task lasts until another worker claimed one too, so a single worker can not take every task before the others start
+    deadline = time.time() + timeout
+    while time.time() < deadline and all([task['worker'] in (None, worker) for task in store.get_tasks()]):
+        time.sleep(LEASE_SECONDS / 10)
+
+def work(path, interleaved=False):
+    store = TaskStore(path, LEASE_SECONDS, MAX_ATTEMPTS)
+    worker = get_worker_id()
+
+    def run_task(task, lost):
+        if interleaved:
+            wait_for_other_workers(store, worker)
+        return f'{task["task_id"]} by {worker}'
+
+    try:
+        run_worker(store, run_task, heartbeat_interval=LEASE_SECONDS / 4)
+    finally:
+        store.close()
+
+def work_interleaved(path):
+    work(path, interleaved=True)
+
+def run_processes(target, path, count):
+    processes = [multiprocessing.Process(target=target, args=(path,)) for _ in range(count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+def create_store(tmp_path, months):
+    path = str(tmp_path / 'scheduler.sqlite')
+    store = TaskStore(path, LEASE_SECONDS, MAX_ATTEMPTS)
+    store.add_tasks('MOD04_3K', 'Lisbon', '2018-01-01', f'2018-{months:02d}-28')
+    return path, store
+
+def test_workers_complete_every_task_once(tmp_path):
+    path, store = create_store(tmp_path, 12)
+    run_processes(work_interleaved, path, 4)
+    tasks = store.get_tasks()
+    assert store.get_counts() == {TaskStore.DONE: 12}
+    assert all([task['attempts'] == 1 for task in tasks])
+    assert len(set([task['output'].split(' by ')[1] for task in tasks])) > 1
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    path, store = create_store(tmp_path, 3)
+    run_processes(claim_and_die, path, 3)
+    assert store.get_counts() == {TaskStore.RUNNING: 3}
+    time.sleep(LEASE_SECONDS * 2)
+    run_processes(work, path, 2)
+    assert store.get_counts() == {TaskStore.DONE: 3}
+    assert all([task['attempts'] == 2 for task in store.get_tasks()])
+
+def test_expired_lease_on_last_attempt_fails_the_task(tmp_path):
+    path, store = create_store(tmp_path, 3)
+    for _ in range(MAX_ATTEMPTS):
+        run_processes(claim_and_die, path, 3)
+        time.sleep(LEASE_SECONDS * 2)
+    assert store.get_counts() == {TaskStore.RUNNING: 3}
+    run_processes(work, path, 2)
+    assert store.get_counts() == {TaskStore.FAILED: 3}
+    assert all([task['error'] is not None for task in store.get_tasks()])
+    assert store.reset_failed() == 3
+    run_processes(work, path, 2)
+    assert store.get_counts() == {TaskStore.DONE: 3}
+
+def test_worker_stops_a_task_claimed_again(tmp_path):
+    path, store = create_store(tmp_path, 1)
+    noticed = []
+
+    def run_task(task, lost):
+        noticed.append(lost.wait(LEASE_SECONDS * 50))
+        raise RuntimeError('stopped')
+
+    # the lease of the stale worker expires before its first heartbeat, its own store never reclaims the task
+    stale_store = TaskStore(path, LEASE_SECONDS * 50, MAX_ATTEMPTS)
+    stale = threading.Thread(target=run_worker, args=(stale_store, run_task, 'stale', LEASE_SECONDS * 3))
+    stale.start()
+    time.sleep(LEASE_SECONDS * 2)
+    assert store.claim('owner')['attempts'] == 2
+    stale.join()
+    stale_store.close()
+    assert noticed == [True]
+    assert [(task['status'], task['worker']) for task in store.get_tasks()] == [(TaskStore.RUNNING, 'owner')]